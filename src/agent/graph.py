@@ -1,7 +1,8 @@
 from langgraph.graph import StateGraph, END
+from langchain_core.runnables import RunnableConfig
 from langchain_ollama import ChatOllama
 from src.agent.state import WebAutomationState
-from src.agent.nodes.planner import plan_workflow
+from src.agent.nodes.planner import plan_workflow, build_planner_prompt
 from src.agent.nodes.executor import execute_action
 from src.agent.nodes.validator import validate_step
 from src.mcp.tools.browser_tools import BrowserTools
@@ -9,7 +10,10 @@ from src.browser.playwright_adapter import PlaywrightAdapter
 from src.knowledge_base.retriever import KnowledgeBaseBuilder
 from src.config import settings
 from src.logger import logger
-from typing import Literal
+from typing import List, Literal, Optional, Tuple
+from diskcache import Cache
+import asyncio
+import hashlib
 import uuid
 from datetime import datetime
 
@@ -20,13 +24,32 @@ class WebAutomationAgent:
         self.llm = ChatOllama(
             model=settings.chat_model,
             base_url=settings.ollama_base_url,
-            temperature=0.0  # Zero for consistency
+            temperature=0.0,  # Zero for consistency
+            format="json",  # JSON mode - output parses directly
+            keep_alive=settings.ollama_keep_alive,  # Keep the model loaded between tasks
+            num_predict=settings.ollama_num_predict  # Cap planner/validator output
         )
+        # Load the model in the background so the first plan doesn't pay for it
+        self._warmup_task: Optional[asyncio.Task] = None
+        try:
+            self._warmup_task = asyncio.get_running_loop().create_task(self._warmup_llm())
+        except RuntimeError:
+            pass  # No running loop - model loads on first call
+        # Launched lazily and shared across tasks; each task gets its own context
         self.browser = PlaywrightAdapter()
-        self.tools = BrowserTools(self.browser)
+        self._browser_lock = asyncio.Lock()
         self.kb_builder = kb_builder  # Pass KB
+        self.plan_cache: Optional[Cache] = Cache(settings.plan_cache_path) if settings.plan_cache_enabled else None
         self.graph = self._build_graph()
     
+    async def _warmup_llm(self) -> None:
+        """One-token request that makes Ollama load the model"""
+        try:
+            await self.llm.bind(options={"num_predict": 1}).ainvoke("ping")
+            logger.info("LLM warmed up")
+        except Exception as e:
+            logger.warning(f"LLM warm-up failed: {e}")
+    
     def _build_graph(self) -> StateGraph:
         """Build LangGraph with recursion protection"""
         graph = StateGraph(WebAutomationState)
@@ -53,13 +76,36 @@ class WebAutomationAgent:
         graph.set_entry_point("plan")
         return graph.compile()
     
+    @staticmethod
+    def _plan_cache_key(prompt: str) -> str:
+        """Hash of the model and the fully rendered planner prompt"""
+        return hashlib.sha1(f"{settings.chat_model}\0{prompt}".encode("utf-8")).hexdigest()
+    
     async def _node_plan(self, state: WebAutomationState) -> WebAutomationState:
-        """Plan with RAG context"""
-        return await plan_workflow(state, self.llm)
+        """Plan with RAG context - LLM plans are cached on identical inputs"""
+        if self.plan_cache is None:
+            return await plan_workflow(state, self.llm)
+        
+        # Rendered once - the key covers exactly what the LLM would see
+        prompt = build_planner_prompt(state)
+        key = self._plan_cache_key(prompt)
+        cached_plan = self.plan_cache.get(key)
+        if cached_plan is not None:
+            logger.info(f"Plan cache hit ({len(cached_plan['steps'])} steps)")
+            state.plan = cached_plan
+            state.current_step = 0
+            state.steps_completed = []
+            return state
+        
+        state = await plan_workflow(state, self.llm, prompt)
+        # Heuristic fallbacks come from a failed LLM call - retry it next time
+        if state.plan.get("source") == "llm" and state.plan.get("steps"):
+            self.plan_cache.set(key, state.plan, expire=settings.plan_cache_ttl)
+        return state
     
-    async def _node_execute(self, state: WebAutomationState) -> WebAutomationState:
-        """Execute with browser"""
-        return await execute_action(state, self.tools)
+    async def _node_execute(self, state: WebAutomationState, config: RunnableConfig) -> WebAutomationState:
+        """Execute with the task's browser context"""
+        return await execute_action(state, config["configurable"]["tools"])
     
     async def _node_validate(self, state: WebAutomationState) -> WebAutomationState:
         """Validate with heuristics"""
@@ -67,8 +113,8 @@ class WebAutomationAgent:
     
     def _should_continue(self, state: WebAutomationState) -> Literal["continue", "done"]:
         """Smart routing - prevents recursion"""
-        error = state.get("error")
-        retries = state.get("retries", 0)
+        error = state.error
+        retries = state.retries
 
         # If there is a hard error and retries exhausted -> done
         if error and retries >= 2:
@@ -76,11 +122,11 @@ class WebAutomationAgent:
             return "done"
 
         # Check steps completion
-        steps = state.get("plan", {}).get("steps", [])
-        current_step = state.get("current_step", 0)
+        steps = state.plan.get("steps", [])
+        current_step = state.current_step
 
-        if state.get("success") or current_step >= len(steps):
-            state["success"] = True 
+        if state.success or current_step >= len(steps):
+            state.success = True 
             logger.info("Workflow completed successfully")
             return "done"
 
@@ -91,20 +137,54 @@ class WebAutomationAgent:
 
         # If error but retries left, do not replan, just try to continue or fail
         if error:
-            state["retries"] = retries + 1
+            state.retries = retries + 1
             logger.warning(f"Error encountered but continuing (attempt {retries + 1}): {error}")
-            state["error"] = None  # Clear error to avoid immediate stop
+            state.error = None  # Clear error to avoid immediate stop
             return "continue"
 
         return "continue"
     
+    async def _ensure_browser(self) -> None:
+        """Launch the shared browser once"""
+        async with self._browser_lock:
+            await self.browser.launch()
+    
+    async def aclose(self) -> None:
+        """Release the shared browser and stop it now rather than after the idle TTL"""
+        # Don't leave the warm-up pending (or its result unretrieved) past shutdown
+        if self._warmup_task is not None:
+            if not self._warmup_task.done():
+                self._warmup_task.cancel()
+            try:
+                await self._warmup_task
+            except asyncio.CancelledError:
+                pass
+            self._warmup_task = None
+        await self.browser.close()
+        await PlaywrightAdapter.shutdown()
+    
+    async def run_many(self, jobs: List[Tuple[str, str]], concurrency: int = 8) -> List[dict]:
+        """Run (task, domain) jobs concurrently, each in its own browser context"""
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def _one(job: Tuple[str, str]) -> dict:
+            task, domain = job
+            async with semaphore:
+                return await self.execute_task_with_context(task, domain, self.kb_builder)
+        
+        await self._ensure_browser()
+        return await asyncio.gather(*(_one(job) for job in jobs))
+    
     async def execute_task_with_context(self, task: str, domain: str, kb_builder: KnowledgeBaseBuilder) -> dict:
         """Enhanced execution with RAG context injection"""
+        session = None
         try:
-            await self.browser.initialize()
+            await self._ensure_browser()
+            session = await self.browser.new_context()
+            tools = BrowserTools(session)
             
             # RAG: Get login context FIRST
-            login_context = await kb_builder.search("login form username password")
+            login_context = await kb_builder.search_many(["login form", "username field", "submit button"])
             logger.info(f"Login selectors found: {len(login_context)} chunks")
             
             # Inject credentials from your history
@@ -114,11 +194,11 @@ class WebAutomationAgent:
             }
             
             # Concrete initial state
-            state: WebAutomationState = {
-                "task": task,
-                "domain": domain,
-                "retrieved_context": login_context,
-                "website_schema": {
+            state = WebAutomationState(
+                task=task,
+                domain=domain,
+                retrieved_context=login_context,
+                website_schema={
                     "login_url": "http://lms2.ai.saveetha.in/login/index.php",
                     "selectors": {
                         "username": "#username",
@@ -126,29 +206,26 @@ class WebAutomationAgent:
                         "loginbtn": "#loginbtn"
                     }
                 },
-                "form_data": form_data,  
-                "plan": {},
-                "current_step": 0,
-                "steps_completed": [],
-                "browser_state": {},
-                "success": False,
-                "error": None,
-                "screenshots": [],
-                "agent_reasoning": "",
-                "execution_id": str(uuid.uuid4()),
-                "timestamp": datetime.now().isoformat(),
-                "retries": 0
-            }
+                form_data=form_data,
+                plan={},
+                current_step=0,
+                steps_completed=[],
+                browser_state={},
+                success=False,
+                error=None,
+                screenshots=[],
+                agent_reasoning="",
+                execution_id=str(uuid.uuid4()),
+                timestamp=datetime.now().isoformat(),
+                retries=0
+            )
             
             logger.info(f"Starting execution: {task}")
             
             # Recursion limit configuration
-            config = {"recursion_limit": 15}
+            config = {"recursion_limit": 15, "configurable": {"tools": tools}}
             result = await self.graph.ainvoke(state, config)
             
-            # Cleanup
-            await self.browser.close()
-            
             logger.info(f"✓ COMPLETE | Success: {result.get('success')} | Steps: {len(result.get('steps_completed', []))}")
             if result.get("screenshots"):
                 logger.info(f"Screenshots: {result['screenshots']}")
@@ -157,10 +234,14 @@ class WebAutomationAgent:
             
         except Exception as e:
             logger.error(f"Execution failed: {str(e)}")
-            await self.browser.close()
             return {
                 "success": False,
                 "error": str(e),
                 "execution_id": str(uuid.uuid4()),
                 "timestamp": datetime.now().isoformat()
             }
+        
+        finally:
+            # Cleanup - only this task's context, the browser stays warm
+            if session:
+                await session.close()
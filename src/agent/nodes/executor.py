@@ -1,21 +1,34 @@
-import json
+import asyncio
 from typing import Dict, Any
 from src.agent.state import WebAutomationState
+from src.agent.nodes.planner import dumps_json
 from src.mcp.tools.browser_tools import BrowserTools
 from src.logger import logger
 
+# Actions that can change the page and invalidate the cached snapshot
+MUTATING_ACTIONS = {"navigate", "click", "submit", "select"}
+
+async def cached_page_state(tools: BrowserTools, state: WebAutomationState) -> Dict[str, Any]:
+    """Page snapshot, re-read only if a mutating action ran since the last read"""
+    if state.page_state_version == state.page_version and state.browser_state:
+        return state.browser_state
+    page_state = await tools.browser.get_page_state()
+    state.browser_state = page_state
+    state.page_state_version = state.page_version
+    return page_state
+
 async def execute_action(state: WebAutomationState, tools: BrowserTools) -> Dict[str, Any]:
     """Execution node - executes planned actions"""
     try:
-        if "plan" not in state or not state["plan"].get("steps"):
-            state["error"] = "No plan available"
+        if not state.plan.get("steps"):
+            state.error = "No plan available"
             return state
         
-        current_step = state.get("current_step", 0)
-        steps = state["plan"].get("steps", [])
+        current_step = state.current_step
+        steps = state.plan.get("steps", [])
         
         if current_step >= len(steps):
-            state["success"] = True
+            state.success = True
             return state
         
         step = steps[current_step]
@@ -43,11 +56,15 @@ async def execute_action(state: WebAutomationState, tools: BrowserTools) -> Dict
             # we should call browser.fill directly if available, OR adapt logic.
 
             try:
-                if hasattr(tools.browser, "fill"):
+                if hasattr(tools.browser, "fill") and len(field_data) == 1:
                     # Direct fill support: selector, value
-                    value = data.get("value", "")
-                    await tools.browser.fill(target, str(value))
-                    result = {"success": True, "page_state": await tools.browser.get_page_state()}
+                    (selector, value), = field_data.items()
+                    # Typed values never show up in page content, so the read can overlap the fill
+                    _, page_state = await asyncio.gather(
+                        tools.browser.fill(selector, str(value)),
+                        cached_page_state(tools, state)
+                    )
+                    result = {"success": True, "page_state": page_state}
                 else:
                     # Fallback to fill_form
                     result = await tools.fill_form(target, field_data)
@@ -72,26 +89,34 @@ async def execute_action(state: WebAutomationState, tools: BrowserTools) -> Dict
         elif action == "screenshot":
             path = f"screenshots/step-{current_step + 1}.png"
             if hasattr(tools.browser, "screenshot"):
-                 saved_path = await tools.browser.screenshot(path=path)
-                 result = {"success": True, "path": saved_path, "page_state": await tools.browser.get_page_state()}
+                 saved_path, page_state = await asyncio.gather(
+                     tools.browser.screenshot(path=path),
+                     cached_page_state(tools, state)
+                 )
+                 result = {"success": True, "path": saved_path, "page_state": page_state}
             else:
                  result = await tools.screenshot()
         
         else:
             result = {"success": False, "error": f"Unknown action: {action}"}
         
+        if action in MUTATING_ACTIONS:
+            state.page_version += 1
+        
         if result and result.get("success"):
-            state["browser_state"] = result.get("page_state", {})
+            state.browser_state = result.get("page_state", {})
+            if "page_state" in result:
+                state.page_state_version = state.page_version
             if "path" in result:
-                state["screenshots"].append(result["path"])
+                state.screenshots.append(result["path"])
             logger.info(f"Step {current_step + 1} executed successfully")
         else:
-            state["error"] = result.get("error", "Action failed") if result else "No result"
+            state.error = result.get("error", "Action failed") if result else "No result"
         
-        state["agent_reasoning"] = json.dumps(result or {}, default=str)
+        state.agent_reasoning = dumps_json(result or {})
         return state
         
     except Exception as e:
         logger.error(f"Error in executor: {str(e)}")
-        state["error"] = f"Execution failed: {str(e)}"
+        state.error = f"Execution failed: {str(e)}"
         return state
@@ -1,16 +1,29 @@
 from langchain_ollama import ChatOllama
 from src.agent.state import WebAutomationState
+from src.config import settings
 from src.logger import logger
+from string import Template
+from functools import lru_cache
 import json
 import re
 
-PLANNER_PROMPT = """
+try:
+    import orjson
+except ImportError:  # stdlib fallback
+    orjson = None
+
+try:
+    import tiktoken
+except ImportError:  # char-based truncation fallback
+    tiktoken = None
+
+PLANNER_PROMPT = Template("""
 You are a smart web automation planner.
-TASK: {task}
-URL: {domain}
+TASK: $task
+URL: $domain
 
 CONTEXT (Scraped HTML):
-{retrieved_context}
+$retrieved_context
 
 INSTRUCTIONS:
 1. Analyze the CONTEXT to find input names/ids for the task.
@@ -19,28 +32,41 @@ INSTRUCTIONS:
 4. Create a JSON plan.
 
 OUTPUT JSON format:
-{{
+{
   "steps": [
-    {{ "step": 1, "action": "navigate", "target": "{domain}", "expected_outcome": "Page loaded" }},
-    {{ "step": 2, "action": "fill", "target": "SELECTOR", "data": {{ "value": "VALUE" }} }},
-    {{ "step": 3, "action": "click", "target": "SELECTOR" }}
+    { "step": 1, "action": "navigate", "target": "$domain", "expected_outcome": "Page loaded" },
+    { "step": 2, "action": "fill", "target": "SELECTOR", "data": { "value": "VALUE" } },
+    { "step": 3, "action": "click", "target": "SELECTOR" }
   ]
-}}
-"""
+}
+""")
+
+# Generic selectors that work on most sites (HN uses 'acct'/'pw', Moodle uses 'username')
+USERNAME_SELECTORS = "input[name='acct'], input[name='username'], input[name='email'], #username, #email"
+PASSWORD_SELECTORS = "input[name='pw'], input[name='password'], #password, #pass"
+SUBMIT_SELECTORS = "input[type='submit'], button[type='submit'], #loginbtn, button:has-text('Log in'), button:has-text('Sign in')"
+
+# One pass pulls every "<key> [is] <value>" credential out of the task text
+_CRED_KEYS = r"username|user|id|password|pass"
+_CRED_RE = re.compile(
+    rf"\b(?P<key>{_CRED_KEYS})\s+(?:is\s+)?"
+    rf"(?:(['\"])(?P<quoted>.*?)\2|(?P<val>(?!(?:is|{_CRED_KEYS})\b)[^\s'\"]+))",
+    re.I
+)
 
-async def plan_workflow(state: WebAutomationState, llm: ChatOllama):
+def build_planner_prompt(state: WebAutomationState) -> str:
+    """Render the exact prompt the planner sends for this state"""
+    return PLANNER_PROMPT.substitute(
+        task=state.task,
+        domain=state.domain,
+        retrieved_context=format_context(state.retrieved_context)
+    )
+
+async def plan_workflow(state: WebAutomationState, llm: ChatOllama, prompt: str = None):
     """Dynamic planning with Smart Fallback"""
     try:
-        # 1. Prepare Context
-        context = state.get("retrieved_context", [])
-        context_str = str(context)[:2000]
-        
-        # 2. Ask LLM
-        prompt = PLANNER_PROMPT.format(
-            task=state["task"],
-            domain=state["domain"],
-            retrieved_context=context_str
-        )
+        # 1-2. Render context into the prompt (unless the caller already did) and ask the LLM
+        prompt = prompt or build_planner_prompt(state)
         response = await llm.ainvoke(prompt)
         plan_text = response.content.strip()
         
@@ -52,20 +78,48 @@ async def plan_workflow(state: WebAutomationState, llm: ChatOllama):
         # 4. SMART FALLBACK (If LLM fails)
         if not plan_json.get("steps"):
             logger.warning("LLM failed. Using Smart Heuristic Fallback.")
-            plan_json = generate_heuristic_plan(state["task"], state["domain"])
+            plan_json = generate_heuristic_plan(state.task, state.domain)
+        else:
+            plan_json["source"] = "llm"
 
-        state["plan"] = plan_json
-        state["current_step"] = 0
-        state["steps_completed"] = []
+        state.plan = plan_json
+        state.current_step = 0
+        state.steps_completed = []
         logger.info(f"Final Plan ({len(plan_json['steps'])} steps): {[s['action'] for s in plan_json['steps']]}")
         return state
         
     except Exception as e:
         logger.error(f"Planner error: {e}")
         # Emergency fallback
-        state["plan"] = generate_heuristic_plan(state["task"], state["domain"])
+        state.plan = generate_heuristic_plan(state.task, state.domain)
         return state
 
+@lru_cache(maxsize=1)
+def _get_tokenizer():
+    """Load the BPE tokenizer once; None if unavailable"""
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logger.warning(f"Tokenizer unavailable, truncating by chars: {e}")
+        return None
+
+def format_context(context, max_tokens: int = None) -> str:
+    """Join retrieved chunks best-first and truncate on a token boundary"""
+    max_tokens = max_tokens or settings.planner_context_tokens
+    if isinstance(context, list) and all(isinstance(c, dict) for c in context):
+        # Chroma cosine distance - smaller is more relevant
+        ranked = sorted(context, key=lambda c: c.get("distance") or 0.0)
+        text = "\n\n".join(str(c.get("content", "")) for c in ranked)
+    else:
+        text = str(context)
+
+    tokenizer = _get_tokenizer()
+    if tokenizer is None:
+        return text[:max_tokens * 4]  # ~4 chars per token
+    return tokenizer.decode(tokenizer.encode(text)[:max_tokens])
+
 def generate_heuristic_plan(task: str, domain: str) -> dict:
     """Generates a plan based on task keywords without site-specific hardcoding"""
     steps = [
@@ -75,19 +129,13 @@ def generate_heuristic_plan(task: str, domain: str) -> dict:
     task_lower = task.lower()
 
     # 1. User/Email Field
-    # Try generic selectors that work on 90% of sites (including HN 'acct')
+    # For a truly robust system, Executor should handle list targets.
+    # Here we pass a comma-separated group and let Playwright match any of them.
     if "user" in task_lower or "login" in task_lower:
-        # We try a list of common selectors. The Executor will try them in order if we pass a list, 
-        # but here we pick the most likely generic ones.
-        # For a truly robust system, Executor should handle list targets.
-        # Here we assume standard 'input' but use a broad selector if possible.
-        
-        # Heuristic: If we don't know the selector, use a common guess list
-        # HN uses 'acct', Moodle uses 'username'.
         steps.append({
             "step": step_count,
             "action": "fill", 
-            "target": "input[name='acct'], input[name='username'], input[name='email'], #username, #email", 
+            "target": USERNAME_SELECTORS, 
             "data": {"value": extract_value(task, ["username", "user", "id"])},
             "expected_outcome": "Username filled"
         })
@@ -98,7 +146,7 @@ def generate_heuristic_plan(task: str, domain: str) -> dict:
         steps.append({
             "step": step_count,
             "action": "fill",
-            "target": "input[name='pw'], input[name='password'], #password, #pass",
+            "target": PASSWORD_SELECTORS,
             "data": {"value": extract_value(task, ["password", "pass"])},
             "expected_outcome": "Password filled"
         })
@@ -108,7 +156,7 @@ def generate_heuristic_plan(task: str, domain: str) -> dict:
     steps.append({
         "step": step_count,
         "action": "click",
-        "target": "input[type='submit'], button[type='submit'], #loginbtn, button:has-text('Log in'), button:has-text('Sign in')",
+        "target": SUBMIT_SELECTORS,
         "expected_outcome": "Form submitted"
     })
     step_count += 1
@@ -121,28 +169,65 @@ def generate_heuristic_plan(task: str, domain: str) -> dict:
         "expected_outcome": "Evidence captured"
     })
 
-    return {"steps": steps}
+    return {"steps": steps, "source": "heuristic"}
 
 def extract_value(text: str, keys: list) -> str:
     """Simple helper to extract 'value' after keyword in task text"""
     # This is a very basic parser. In a real system, use an LLM extractor or strict arguments.
-    # Here we just try to return a dummy if we can't find it, or the user should update main.py
-    words = text.split()
-    for i, word in enumerate(words):
-        if any(k in word.lower() for k in keys) and i + 2 < len(words):
-            # matches "username is 'bob'" -> returns 'bob'
-            val = words[i+2].strip("'").strip('"')
-            return val
+    # matches "username is 'bob'" -> returns 'bob'
+    for match in _CRED_RE.finditer(text):
+        if match.group("key").lower() in keys:
+            quoted = match.group("quoted")
+            return quoted if quoted is not None else match.group("val")
     return "unknown_value"
 
+def loads_json(text: str):
+    """Decode JSON with orjson when available"""
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+def dumps_json(obj) -> str:
+    """Encode JSON with orjson when available, stringifying unknown types"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(obj, default=str)
+
+def _find_json_span(text: str):
+    """Return the first balanced {...} substring in a single linear scan"""
+    depth = 0
+    start = -1
+    in_string = False
+    escaped = False
+    for i, c in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif c == "\\":
+                escaped = True
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = depth > 0
+        elif c == "{":
+            if depth == 0:
+                start = i
+            depth += 1
+        elif c == "}" and depth > 0:
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return None
+
 def extract_json(text: str) -> dict:
+    """Parse LLM JSON output; the LLM runs in JSON mode, brace scan is an emergency fallback"""
     try:
-        return json.loads(text)
+        return loads_json(text)
     except:
-        json_match = re.search(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}', text, re.DOTALL)
-        if json_match:
+        span = _find_json_span(text)
+        if span:
             try:
-                return json.loads(json_match.group(0))
+                return loads_json(span)
             except:
                 pass
     return {"steps": []}
@@ -1,32 +1,135 @@
-from typing import List, Dict, Any
+from typing import Iterator, List, Dict, Any, Optional
 from langchain_core.documents import Document
-from src.knowledge_base.embedder import EmbeddingService
+from src.knowledge_base.embedder import get_embedder, select_device
 from src.knowledge_base.chroma_store import ChromaVectorStore
 from src.logger import logger
 from sentence_transformers import SentenceTransformer
+from functools import lru_cache
 import numpy as np
 
 
+QUANT_MODES = ("int8", "binary")
+
+# Set bits per byte value, for Hamming distance over packed binary codes
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
 class KnowledgeBaseBuilder:
     """Build and manage knowledge base from scraped content"""
     
-    def __init__(self):
+    def __init__(self, quant: Optional[str] = None):
+        if quant is not None and quant not in QUANT_MODES:
+            raise ValueError(f"Unsupported quantization '{quant}', expected one of {QUANT_MODES}")
+        self.quant = quant
+        
         try:
-            self.embedder = EmbeddingService()
+            self.embedder = get_embedder()
         except:
             # Fallback to local embeddings
-            logger.info("Using local SentenceTransformer embeddings")
-            self.embedder = SentenceTransformer("all-MiniLM-L6-v2")
+            device = select_device()
+            logger.info(f"Using local SentenceTransformer embeddings ({device})")
+            self.embedder = SentenceTransformer("all-MiniLM-L6-v2", device=device)
         
         self.vector_store = ChromaVectorStore()
+        # Compact codes for the coarse pass live in memory (Chroma only stores float32);
+        # the FP32 vectors in Chroma are used for the rerank
+        self._codes: Optional[np.ndarray] = None
+        self._code_ids: List[str] = []
+        self._code_rows: Dict[str, int] = {}  # id -> row of _codes, so each id is indexed once
         self.embedding_dim = 384  # MiniLM dimension
+        
+        # Repeated queries skip the transformer forward pass
+        self._encode_query = lru_cache(maxsize=1024)(
+            lambda q: tuple(self.embedder.encode([q], normalize_embeddings=True)[0].tolist())
+        )
+    
+    def _chunk_text(self, text: str, chunk_size: int = 1000, overlap: int = 100) -> Iterator[str]:
+        """Lazily yield overlapping chunks of text"""
+        assert 0 <= overlap < chunk_size, "overlap must be smaller than chunk_size"
+        stride = chunk_size - overlap
+        for i in range(0, len(text), stride):
+            yield text[i:i + chunk_size]
+    
+    async def _encode(self, texts: List[str]) -> np.ndarray:
+        """Encode a batch of texts in a single model call"""
+        if isinstance(self.embedder, SentenceTransformer):
+            return self.embedder.encode(
+                texts,
+                batch_size=64 if self.embedder.device.type == "cpu" else 256,
+                show_progress_bar=False,
+                convert_to_numpy=True,
+                normalize_embeddings=True
+            )
+        
+        try:
+            embeddings = await self.embedder.embed_documents(texts)
+        except TypeError:
+            # Embedder without list support - single pass per text
+            embeddings = [await self.embedder.embed_text(text) for text in texts]
+        return np.asarray(embeddings, dtype=np.float32)
+    
+    async def _embed_query(self, query: str) -> np.ndarray:
+        """Embed a search query, served from cache on repeats"""
+        if isinstance(self.embedder, SentenceTransformer):
+            return np.asarray(self._encode_query(query), dtype=np.float32)
+        # EmbeddingService caches query embeddings itself
+        return np.asarray(await self.embedder.embed_text(query), dtype=np.float32)
     
-    def _chunk_text(self, text: str, chunk_size: int = 1000, overlap: int = 100) -> List[str]:
-        """Split text into overlapping chunks"""
-        chunks = []
-        for i in range(0, len(text), chunk_size - overlap):
-            chunks.append(text[i:i + chunk_size])
-        return chunks
+    def _quantize(self, matrix: np.ndarray) -> np.ndarray:
+        """Quantize L2-normalized embeddings to int8 (1 B/dim) or packed sign bits (1 bit/dim)"""
+        if self.quant == "int8":
+            return np.clip(np.round(matrix * 127), -128, 127).astype(np.int8)
+        return np.packbits(matrix > 0, axis=-1)
+    
+    def _index_codes(self, ids: List[str], codes: np.ndarray) -> None:
+        """Store codes by id - rows of ids seen before are overwritten, new ids appended"""
+        latest = {doc_id: j for j, doc_id in enumerate(ids)}  # Last occurrence wins within a batch
+        updated, fresh = [], []
+        for doc_id, j in latest.items():
+            row = self._code_rows.get(doc_id)
+            if row is None:
+                self._code_rows[doc_id] = len(self._code_ids)
+                self._code_ids.append(doc_id)
+                fresh.append(j)
+            else:
+                updated.append((row, j))
+        
+        if updated:
+            rows, batch_rows = zip(*updated)
+            self._codes[list(rows)] = codes[list(batch_rows)]
+        if fresh:
+            self._codes = codes[fresh] if self._codes is None else np.concatenate([self._codes, codes[fresh]])
+    
+    def _coarse_candidates(self, query_emb: np.ndarray, n: int) -> List[str]:
+        """Nearest ids by the in-memory quantized codes"""
+        query_code = self._quantize(query_emb[None, :])[0]
+        if self.quant == "int8":
+            scores = self._codes.astype(np.int32) @ query_code.astype(np.int32)
+            order = np.argsort(-scores)
+        else:
+            # Hamming distance: popcount of XOR over the packed bytes
+            distances = _POPCOUNT[np.bitwise_xor(self._codes, query_code)].sum(axis=1, dtype=np.int32)
+            order = np.argsort(distances)
+        return [self._code_ids[i] for i in order[:n]]
+    
+    async def _rerank(self, ids: List[str], query_emb: np.ndarray, k: int) -> List[Dict[str, Any]]:
+        """Rerank quantized candidates with their FP32 embeddings"""
+        if not ids:
+            return []
+        
+        stored = await self.vector_store.get_with_embeddings(ids)
+        matrix = np.asarray(stored["embeddings"], dtype=np.float32)
+        scores = matrix @ query_emb.astype(np.float32)
+        order = np.argsort(-scores)[:k]
+        return [
+            {
+                "id": stored["ids"][i],
+                "content": stored["documents"][i],
+                "metadata": stored["metadatas"][i],
+                "distance": float(1.0 - scores[i])
+            }
+            for i in order
+        ]
     
     async def build_from_scraped_pages(self, scraped_pages: Dict[str, dict]) -> None:
         logger.info(f"Building KB from {len(scraped_pages)} pages")
@@ -47,6 +150,7 @@ class KnowledgeBaseBuilder:
                 doc = Document(
                     page_content=content,
                     metadata={
+                        "id": url,
                         "source_url": url,
                         "title": page_data.get('title', ''),
                         "forms": page_data.get("forms", []),
@@ -56,18 +160,27 @@ class KnowledgeBaseBuilder:
                 documents.append(doc)
         
         if documents:
-            # Local embeddings
-            embeddings = []
-            for doc in documents:
-                emb = self.embedder.encode(doc.page_content).tolist()
-                embeddings.append(emb)
+            # Local embeddings - one batched model call for all documents
+            texts = [doc.page_content for doc in documents]
+            embeddings = await self._encode(texts)
             
-            await self.vector_store.add_documents(documents, embeddings)
+            # Upsert - ids are page URLs, so a re-scraped page replaces its old vector
+            await self.vector_store.add_documents(documents, embeddings, upsert=True)
             logger.info(f"Stored {len(documents)} docs with local embeddings")
+            
+            if self.quant:
+                codes = self._quantize(np.asarray(embeddings, dtype=np.float32))
+                self._index_codes([doc.metadata["id"] for doc in documents], codes)
+                logger.info(f"Indexed {len(documents)} {self.quant} codes ({codes.nbytes} bytes)")
         else:
             logger.warning("No valid pages found")
     
     async def search(self, query: str, k: int = 5) -> List[Dict[str, Any]]:
         """Semantic search"""
-        emb = self.embedder.encode([query])[0].tolist()
-        return await self.vector_store.similarity_search(emb, k=k)
+        query_emb = await self._embed_query(query)
+        
+        if self.quant and self._codes is not None:
+            candidate_ids = self._coarse_candidates(query_emb, k * 4)
+            return await self._rerank(candidate_ids, query_emb, k)
+        
+        return await self.vector_store.search(query_emb.tolist(), k)
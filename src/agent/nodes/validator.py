@@ -1,5 +1,4 @@
 from typing import Dict, Any
-import json
 import re
 from langchain_ollama import ChatOllama 
 from src.agent.nodes.planner import extract_json
@@ -24,28 +23,42 @@ Output ONLY JSON:
 {{"success": true/false, "reason": "brief", "should_retry": false}}
 """
 
+SUCCESS_KEYWORDS = frozenset(["dashboard", "profile", "welcome", "logout", "student", "courses", "saveetha"])
+LOGIN_FORM_INDICATORS = frozenset(["#login", "#username"])
+
+# Single alternation over every keyword - one linear scan finds all hits
+_KEYWORD_RE = re.compile(
+    "|".join(re.escape(kw) for kw in sorted(SUCCESS_KEYWORDS | LOGIN_FORM_INDICATORS, key=len, reverse=True))
+)
+
+# Heuristic verdicts at or above this confidence skip the LLM check
+CONFIDENCE_THRESHOLD = 0.8
+
+# Only these page_state fields are inspected by the heuristics
+PAGE_TEXT_FIELDS = ("url", "title", "html")
+
 async def validate_step(state: WebAutomationState, llm: ChatOllama) -> Dict[str, Any]:
     """Validation node - verifies step success with heuristics first"""
     try:
-        plan = state.get("plan", {})
+        plan = state.plan
         steps = plan.get("steps", [])
-        current_step = state.get("current_step", 0)
+        current_step = state.current_step
         
         if current_step >= len(steps):
-            state["success"] = True
+            state.success = True
             logger.info("All steps completed")
             return state
         
         step = steps[current_step]
         expected_outcome = step.get("expected_outcome", "Complete step")
-        page_state = state.get("browser_state", {})
-        error = state.get("error", "None")
+        page_state = state.browser_state
+        error = state.error
         
         # HEURISTIC VALIDATION FIRST (fast, no LLM)
         validation = validate_heuristic(step, page_state, error, current_step)
         
-        # LLM only if heuristic fails
-        if not validation.get("success"):
+        # LLM only if heuristic fails without a definitive verdict
+        if not validation.get("success") and validation.get("confidence", 0) < CONFIDENCE_THRESHOLD:
             prompt = VALIDATOR_PROMPT.format(
                 expected_outcome=expected_outcome,
                 page_state=str(page_state),
@@ -55,63 +68,70 @@ async def validate_step(state: WebAutomationState, llm: ChatOllama) -> Dict[str,
             validation = extract_json(response.content.strip())
         
         if validation.get("success"):
-            state["steps_completed"].append(current_step)
+            state.steps_completed.append(current_step)
             # Increment step
-            state["current_step"] = current_step + 1
+            state.current_step = current_step + 1
             logger.info(f"Step {current_step + 1} validated: {validation.get('reason', 'success')}")
             
-            if state["current_step"] >= len(steps):
-                state["success"] = True
+            if state.current_step >= len(steps):
+                state.success = True
                 logger.info("VALIDATION COMPLETE: All steps finished successfully")
         else:
             logger.warning(f"Step {current_step + 1} failed: {validation.get('reason', 'unknown')}")
             if not validation.get("should_retry", False):
-                state["error"] = validation.get('reason', 'Validation failed')
+                state.error = validation.get('reason', 'Validation failed')
                 if current_step < 3:
-                    state["current_step"] = current_step + 1
-                    state["error"] = None  
+                    state.current_step = current_step + 1
+                    state.error = None  
         
         return state
         
     except Exception as e:
         logger.error(f"Validator crashed: {str(e)}")
-        current_step = state.get("current_step", 0)
+        current_step = state.current_step
         # Auto-advance first 5 steps
         if current_step <= 4:
-            state["current_step"] = current_step + 1
+            state.current_step = current_step + 1
             logger.info(f"Auto-advance step {current_step + 1}")
         else:
-            state["error"] = f"Validation failed: {str(e)}"
+            state.error = f"Validation failed: {str(e)}"
         return state
 
 def validate_heuristic(step: Dict, page_state: Dict, error: str, current_step: int) -> Dict[str, Any]:
     """Fast heuristic validation - no LLM needed"""
     action = step.get("action", "").lower()
     target = step.get("target", "").lower()
-    page_content = str(page_state).lower()
+    page_content = " ".join(str(page_state.get(k) or "") for k in PAGE_TEXT_FIELDS).lower()
     current_url = page_state.get("url", "").lower()
+    hits = set(_KEYWORD_RE.findall(page_content))
     
     if action == "navigate":
         if "login/index.php" in current_url:
-            return {"success": True, "reason": "On login page", "should_retry": False}
+            return {"success": True, "reason": "On login page", "should_retry": False, "confidence": 1.0}
     
     elif action == "fill":
-        # Success if target selector exists in page content (simpler check)
+        # Fills raise when the field never appears, so an error-free fill is trusted;
+        # page_state carries no HTML after a fill to check the selector against
         clean_target = target.replace("#", "").replace(".", "")
-        if clean_target in page_content or target in page_content:
-            return {"success": True, "reason": f"Filled {target}", "should_retry": False}
+        if not error or clean_target in page_content or target in page_content:
+            return {"success": True, "reason": f"Filled {target}", "should_retry": False, "confidence": 0.9}
     
     elif action in ["click", "submit"]:
-        no_login_form = all(ind not in page_content for ind in ["#login", "#username"])
+        no_login_form = not (hits & LOGIN_FORM_INDICATORS)
         page_changed = "login/index.php" not in current_url
         if no_login_form or page_changed:
-            return {"success": True, "reason": "Form submitted/page changed", "should_retry": False}
+            return {"success": True, "reason": "Form submitted/page changed", "should_retry": False, "confidence": 0.8}
     
     elif action == "screenshot":
-        return {"success": True, "reason": "Screenshot completed", "should_retry": False}
+        return {"success": True, "reason": "Screenshot completed", "should_retry": False, "confidence": 1.0}
     
     # Only check for dashboard success AFTER login click (step 4 onwards)
     if current_step >= 3:
-        success_keywords = ["dashboard", "profile", "welcome", "logout", "student", "courses", "saveetha"]
-        has_success = any(kw in page_content for kw in success_keywords)
-        # S
+        if hits & SUCCESS_KEYWORDS:
+            return {"success": True, "reason": "Post-login page detected", "should_retry": False, "confidence": 0.9}
+    
+    # Executor reported a hard error - no need to ask the LLM
+    if error and error != "None":
+        return {"success": False, "reason": f"Step error: {error}", "should_retry": False, "confidence": 1.0}
+    
+    return {"success": False, "reason": "Heuristic check inconclusive", "should_retry": False, "confidence": 0.0}
@@ -1,35 +1,38 @@
 from typing import Dict, List, Any, Optional
-from typing_extensions import TypedDict
+from dataclasses import dataclass, field
 
-class WebAutomationState(TypedDict, total=False):
+@dataclass(slots=True)
+class WebAutomationState:
     """Shared state for LangGraph agent"""
     
     # Task Definition
-    task: str
-    domain: str
+    task: str = ""
+    domain: str = ""
     
     # Knowledge Base Context
-    retrieved_context: List[str]
-    website_schema: Dict[str, Any]
+    retrieved_context: List[Dict[str, Any]] = field(default_factory=list)
+    website_schema: Dict[str, Any] = field(default_factory=dict)
     
     # Planning
-    plan: Dict[str, Any]
-    current_step: int
-    steps_completed: List[str]
+    plan: Dict[str, Any] = field(default_factory=dict)
+    current_step: int = 0
+    steps_completed: List[int] = field(default_factory=list)
     
     # Execution State
-    browser_state: Dict[str, Any]
-    form_data: Dict[str, str]
+    browser_state: Dict[str, Any] = field(default_factory=dict)
+    page_version: int = 0  # Bumped by actions that can change the page
+    page_state_version: int = -1  # page_version that browser_state was read at
+    form_data: Dict[str, str] = field(default_factory=dict)
     
     # Results
-    success: bool
-    error: Optional[str]
-    screenshots: List[str]
+    success: bool = False
+    error: Optional[str] = None
+    screenshots: List[str] = field(default_factory=list)
     
     # Reasoning
-    agent_reasoning: str
+    agent_reasoning: str = ""
     
     # Metadata
-    execution_id: str
-    timestamp: str
-    retries: int
+    execution_id: str = ""
+    timestamp: str = ""
+    retries: int = 0
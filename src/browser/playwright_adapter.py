@@ -2,26 +2,98 @@ from playwright.async_api import async_playwright, Browser, BrowserContext, Page
 from src.config import settings
 from src.logger import logger
 from typing import Optional
+import asyncio
 
 class PlaywrightAdapter:
-    """Wrapper around Playwright for browser automation"""
+    """Wrapper around Playwright for browser automation.
+    
+    All adapters share one ref-counted Playwright process and Chromium browser;
+    each adapter owns its own context and page.
+    """
+    
+    _pw_singleton = None
+    _browser_singleton: Optional[Browser] = None
+    _refcount = 0
+    _lock = asyncio.Lock()
+    _idle_handle: Optional[asyncio.TimerHandle] = None
     
     def __init__(self):
         self.playwright = None
         self.browser: Optional[Browser] = None
         self.context: Optional[BrowserContext] = None
         self.page: Optional[Page] = None
+        self._acquired = False
+    
+    @classmethod
+    async def _acquire_browser(cls) -> Browser:
+        """Take a reference on the shared browser, launching it if needed"""
+        async with cls._lock:
+            if cls._idle_handle:
+                cls._idle_handle.cancel()
+                cls._idle_handle = None
+            
+            if cls._browser_singleton is None:
+                logger.info("1. Starting Playwright...")
+                cls._pw_singleton = await async_playwright().start()
+                logger.info(f"2. Playwright: {cls._pw_singleton is not None}")
+                
+                logger.info("3. Launching Chromium...")
+                cls._browser_singleton = await cls._pw_singleton.chromium.launch(headless=True)
+                logger.info(f"4. Browser: {cls._browser_singleton is not None}")
+            
+            cls._refcount += 1
+            return cls._browser_singleton
+    
+    @classmethod
+    async def _release_browser(cls) -> None:
+        """Drop a reference; the browser stays warm for browser_idle_ttl seconds"""
+        async with cls._lock:
+            cls._refcount = max(cls._refcount - 1, 0)
+            if cls._refcount == 0 and cls._browser_singleton is not None:
+                loop = asyncio.get_running_loop()
+                cls._idle_handle = loop.call_later(
+                    settings.browser_idle_ttl,
+                    lambda: asyncio.ensure_future(cls.shutdown())
+                )
+    
+    @classmethod
+    async def shutdown(cls) -> None:
+        """Stop the shared browser and Playwright if no adapter is using them"""
+        async with cls._lock:
+            if cls._refcount > 0:
+                return
+            if cls._idle_handle:
+                cls._idle_handle.cancel()
+                cls._idle_handle = None
+            try:
+                if cls._browser_singleton:
+                    await cls._browser_singleton.close()
+                if cls._pw_singleton:
+                    await cls._pw_singleton.stop()
+                logger.info("Browser closed")
+            except Exception as e:
+                logger.error(f"Error closing browser: {str(e)}")
+            finally:
+                cls._browser_singleton = None
+                cls._pw_singleton = None
+    
+    async def launch(self):
+        """Attach to the shared browser, launching it if not already running"""
+        if self._acquired:
+            return
+        
+        self._acquired = True
+        try:
+            self.browser = await self._acquire_browser()
+            self.playwright = self._pw_singleton
+        except Exception:
+            self._acquired = False
+            raise
     
     async def initialize(self):
         """Initialize Playwright and launch browser"""
         try:
-            logger.info("1. Starting Playwright...")
-            self.playwright = await async_playwright().start()
-            logger.info(f"2. Playwright: {self.playwright is not None}")
-            
-            logger.info("3. Launching Chromium...")
-            self.browser = await self.playwright.chromium.launch(headless=True)
-            logger.info(f"4. Browser: {self.browser is not None}")
+            await self.launch()
             
             logger.info("5. New context...")
             self.context = await self.browser.new_context()
@@ -43,10 +115,19 @@ class PlaywrightAdapter:
             await self.close()
             raise
 
-    async def navigate(self, url: str) -> str:
-        """Navigate to URL"""
+    async def new_context(self) -> "PlaywrightAdapter":
+        """Open an isolated context + page on the shared browser.
+        
+        Closing the returned adapter only closes its context.
+        """
+        adapter = PlaywrightAdapter()
+        await adapter.initialize()
+        return adapter
+    
+    async def navigate(self, url: str, wait_until: str = "domcontentloaded") -> str:
+        """Navigate to URL - pass wait_until="networkidle" only for pages that need it"""
         try:
-            await self.page.goto(url, wait_until="networkidle")
+            await self.page.goto(url, wait_until=wait_until, timeout=settings.browser_timeout)
             logger.info(f"Navigated to {url}")
             return self.page.url
         except Exception as e:
@@ -58,38 +139,28 @@ class PlaywrightAdapter:
         try:
             logger.info(f"Filling form {form_selector} with {len(field_data)} fields")
             
-            for field_name, value in field_data.items():
-                # FIXED: Use field_name directly as selector (e.g., "#username")
-                # Previously used f"{form_selector} [name='{field_name}']" which broke IDs
-                field_selector = field_name 
-                await self.page.wait_for_selector(field_selector, timeout=10000)
-                await self.page.fill(field_selector, str(value))
-                logger.info(f"Filled {field_selector} with {value}")
+            # FIXED: Use field_name directly as selector (e.g., "#username")
+            # Previously used f"{form_selector} [name='{field_name}']" which broke IDs
+            await asyncio.gather(*(
+                self.fill(field_name, value)
+                for field_name, value in field_data.items()
+            ))
                 
         except Exception as e:
             logger.error(f"Error filling form: {e}")
             raise
-
-        async def fill(self, selector: str, value: str) -> None:
-            """Fill field - supports comma-separated fallback selectors"""
-            try:
-                # Try to wait for the group of selectors
-                # Playwright supports "input[name='a'], input[name='b']" natively!
-                # It will wait for ANY of them to appear.
-                
-                logger.info(f"Attempting to fill: {selector}")
-                element = await self.page.wait_for_selector(selector, state="visible", timeout=10000)
-                
-                if element:
-                    await element.fill(str(value))
-                    logger.info(f"Filled {selector} with '{value}'")
-                else:
-                    raise Exception("Element not found")
-                    
-            except Exception as e:
-                logger.error(f"Error filling {selector}: {e}")
-                raise
-
+    
+    async def fill(self, selector: str, value: str) -> None:
+        """Fill field - supports comma-separated fallback selectors"""
+        try:
+            # Playwright supports "input[name='a'], input[name='b']" natively and waits
+            # for ANY of them; .first keeps such selector lists out of strict mode.
+            # Locator.fill waits for the field and fills it in a single action.
+            await self.page.locator(selector).first.fill(str(value), timeout=10000)
+            logger.opt(lazy=True).debug("Filled {} with {}", lambda: selector, lambda: value)
+        except Exception as e:
+            logger.error(f"Error filling {selector}: {e}")
+            raise
     
     async def click(self, selector: str) -> None:
         """Click element"""
@@ -112,11 +183,12 @@ class PlaywrightAdapter:
     async def submit_form(self, form_selector: str) -> None:
         """Submit form"""
         try:
-            submit_btn = await self.page.query_selector(f"{form_selector} [type='submit']")
-            if submit_btn:
+            submit_btn = self.page.locator(f"{form_selector} [type='submit']").first
+            if await submit_btn.count():
                 await submit_btn.click()
             else:
-                await self.page.evaluate(f"document.querySelector('{form_selector}').submit()")
+                # Form element is passed as the handle - no selector interpolated into JS
+                await self.page.locator(form_selector).first.evaluate("form => form.submit()")
             
             logger.info(f"Submitted form {form_selector}")
         except Exception as e:
@@ -132,14 +204,21 @@ class PlaywrightAdapter:
             logger.error(f"Error extracting text from {selector}: {str(e)}")
             return ""
     
-    async def get_page_state(self) -> dict:
-        """Get current page state"""
+    async def get_page_state(self, include_html: bool = False) -> dict:
+        """Get current page state - url and title, plus an HTML preview on request"""
         try:
-            html = await self.page.content()
+            if not include_html:
+                return {"url": self.page.url, "title": await self.page.title()}
+            
+            # Slice in the page so only the preview crosses CDP, and overlap both round-trips
+            html, title = await asyncio.gather(
+                self.page.evaluate("document.documentElement.outerHTML.slice(0, 2000)"),
+                self.page.title()
+            )
             return {
                 "url": self.page.url,
-                "title": await self.page.title(),
-                "html": html[:1000]  # First 1000 chars
+                "title": title,
+                "html": html  # First 2000 chars
             }
         except Exception as e:
             logger.error(f"Error getting page state: {str(e)}")
@@ -168,14 +247,18 @@ class PlaywrightAdapter:
             raise
     
     async def close(self):
-        """Close browser"""
+        """Close this adapter's context and release the shared browser"""
         try:
             if self.context:
                 await self.context.close()
-            if self.browser:
-                await self.browser.close()
-            if self.playwright:
-                await self.playwright.stop()
-            logger.info("Browser closed")
+                self.context = None
+                self.page = None
+            logger.info("Browser context closed")
         except Exception as e:
             logger.error(f"Error closing browser: {str(e)}")
+        finally:
+            if self._acquired:
+                self._acquired = False
+                self.browser = None
+                self.playwright = None
+                await self._release_browser()
@@ -8,9 +8,16 @@ class Settings(BaseSettings):
     chat_model: str = "llama3.2"
     ollama_base_url: str = "http://localhost:11434"
     llm_type: str = "ollama"
+    ollama_keep_alive: str = "30m"
+    ollama_num_predict: int = 256
     
     # Embeddings
     embedding_model: str = "all-MiniLM-L6-v2"
+    embedding_device: str = "auto"  # auto | cpu | cuda | mps
+    embedding_precision: str = "auto"  # auto (fp16 on CUDA) | fp32 | fp16
+    # Keep only the first N dims (re-normalized) to shrink stored vectors, e.g. 256.
+    # Changing it requires rebuilding the Chroma collection.
+    embedding_truncate_dim: Optional[int] = None
     
     # Existing fields (keep all)
     gemini_api_key: str = ""
@@ -20,8 +27,21 @@ class Settings(BaseSettings):
     
     playwright_headed: bool = True
     browser_timeout: int = 30000
+    browser_idle_ttl: float = 30.0  # Seconds the shared browser stays warm once unused
     max_retries: int = 3
     
+    # Scraper: try a plain HTTP fetch before rendering with Playwright
+    scraper_static_fetch: bool = True
+    scraper_output_path: str = "./scraped_pages.ndjson"
+    
+    # Planner prompt budget for retrieved context
+    planner_context_tokens: int = 512
+    
+    # Planner cache (set PLAN_CACHE_ENABLED=false to debug planning)
+    plan_cache_enabled: bool = True
+    plan_cache_path: str = "./.plan_cache"
+    plan_cache_ttl: float = 86400.0  # Seconds before a cached plan is re-planned
+    
     langgraph_log_level: str = "INFO"
     langsmith_api_key: Optional[str] = None
     langsmith_project: str = "agentic-web-automation"
@@ -1,9 +1,10 @@
 import chromadb
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Set
 from langchain_core.documents import Document
 from src.config import settings
 from src.logger import logger
 from pathlib import Path
+import numpy as np
 
 class ChromaVectorStore:
     """Chroma vector database wrapper"""
@@ -20,39 +21,66 @@ class ChromaVectorStore:
             metadata={"hnsw:space": "cosine"}
         )
         
+        # Bind the write method and look up the batch limit once rather than on every add
+        self._add = self.collection.add
+        self._upsert = self.collection.upsert
+        self.max_batch_size = self.client.get_max_batch_size()
+        
         logger.info(f"Initialized Chroma collection: {collection_name}")
     
-    async def add_documents(self, documents: List[Document], embeddings: List[List[float]]) -> None:
-        """Add documents - compatible with Chroma 0.4+ and 0.5+"""
-        if not documents or not embeddings:
+    async def add_documents(self, documents: List[Document], embeddings: np.ndarray, upsert: bool = False) -> None:
+        """Add (or with upsert=True, add or replace) documents in as few Chroma writes as the client allows"""
+        if not documents or len(embeddings) == 0:
             logger.warning("Skipping empty add_documents")
             return
         
+        # One contiguous float32 matrix - Chroma takes ndarrays without re-copying lists
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        
         texts = [doc.page_content for doc in documents]
         metadatas = [doc.metadata for doc in documents]
         ids = [doc.metadata.get("id", f"doc_{i}") for i, doc in enumerate(documents)]
         
         try:
-            self.collection.add_texts(
-                texts=texts,
-                embeddings=embeddings,
-                metadatas=metadatas,
-                ids=ids
-            )
-            logger.info(f"Added {len(texts)} docs (add_texts API)")
-        except AttributeError:
-            self.collection.add(
-                ids=ids,
-                embeddings=embeddings,
-                documents=texts,
-                metadatas=metadatas
-            )
-            logger.info(f"Added {len(texts)} docs (add API fallback)")
-        
+            write = self._upsert if upsert else self._add
+            batch_size = self.max_batch_size
+            for start in range(0, len(ids), batch_size):
+                end = start + batch_size
+                write(
+                    ids=ids[start:end],
+                    embeddings=embeddings[start:end],
+                    documents=texts[start:end],
+                    metadatas=metadatas[start:end]
+                )
+            logger.info(f"Added {len(texts)} docs")
         except Exception as e:
             logger.error(f"Chroma add failed: {e}")
             raise
    
+    async def existing_ids(self, ids: List[str]) -> Set[str]:
+        """Subset of ids already stored - looked up without loading documents or embeddings"""
+        try:
+            found = set()
+            for start in range(0, len(ids), self.max_batch_size):
+                results = self.collection.get(ids=ids[start:start + self.max_batch_size], include=[])
+                found.update(results["ids"])
+            return found
+        except Exception as e:
+            logger.error(f"Error checking existing ids: {str(e)}")
+            raise
+    
+    async def delete_stale(self, source_url: str, keep_ids: Set[str]) -> int:
+        """Delete chunks stored for source_url whose id is not in keep_ids"""
+        try:
+            stored = self.collection.get(where={"source_url": source_url}, include=[])
+            stale = [doc_id for doc_id in stored["ids"] if doc_id not in keep_ids]
+            for start in range(0, len(stale), self.max_batch_size):
+                self.collection.delete(ids=stale[start:start + self.max_batch_size])
+            return len(stale)
+        except Exception as e:
+            logger.error(f"Error deleting stale chunks: {str(e)}")
+            raise
+    
     async def search(self, query_embedding: List[float], n_results: int = 5) -> List[Dict[str, Any]]:
         """Search for similar documents"""
         try:
@@ -61,20 +89,55 @@ class ChromaVectorStore:
                 n_results=n_results
             )
             
-            documents = []
-            for i in range(len(results["documents"])):
-                documents.append({
-                    "id": results["ids"][i],
-                    "content": results["documents"][i],
-                    "metadata": results["metadatas"][i],
-                    "distance": results["distances"][i]
-                })
+            # query() returns one list per query embedding - we sent exactly one
+            ids = results["ids"][0]
+            docs = results["documents"][0]
+            metas = results["metadatas"][0]
+            dists = results["distances"][0]
             
-            return documents
+            return [
+                {"id": ids[i], "content": docs[i], "metadata": metas[i], "distance": dists[i]}
+                for i in range(len(docs))
+            ]
+        except Exception as e:
+            logger.error(f"Error searching: {str(e)}")
+            raise
+    
+    async def search_many(self, query_embeddings: List[List[float]], n_results: int = 5) -> List[List[Dict[str, Any]]]:
+        """Search for several queries in one ANN call - one result list per query"""
+        try:
+            results = self.collection.query(
+                query_embeddings=query_embeddings,
+                n_results=n_results
+            )
+            
+            return [
+                [
+                    {
+                        "id": results["ids"][q][i],
+                        "content": results["documents"][q][i],
+                        "metadata": results["metadatas"][q][i],
+                        "distance": results["distances"][q][i]
+                    }
+                    for i in range(len(results["ids"][q]))
+                ]
+                for q in range(len(query_embeddings))
+            ]
         except Exception as e:
             logger.error(f"Error searching: {str(e)}")
             raise
     
+    async def get_with_embeddings(self, ids: List[str]) -> Dict[str, Any]:
+        """Fetch documents together with their stored embeddings"""
+        try:
+            return self.collection.get(
+                ids=ids,
+                include=["embeddings", "documents", "metadatas"]
+            )
+        except Exception as e:
+            logger.error(f"Error fetching embeddings: {str(e)}")
+            raise
+    
     async def search_by_metadata(self, where: Dict[str, Any], n_results: int = 5) -> List[Dict[str, Any]]:
         """Search by metadata filters"""
         try:
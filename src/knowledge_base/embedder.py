@@ -1,21 +1,70 @@
 from typing import List
-from langchain_huggingface import HuggingFaceEmbeddings
+import os
+from functools import lru_cache
+from sentence_transformers import SentenceTransformer
+import numpy as np
 from src.config import settings
 from src.logger import logger
 
+def select_device() -> str:
+    """Best available torch device: CUDA, then Apple MPS, then CPU"""
+    import torch
+    
+    if torch.cuda.is_available():
+        return "cuda"
+    if torch.backends.mps.is_available():
+        return "mps"
+    return "cpu"
+
 class EmbeddingService:
     """Local embeddings - no API quota issues"""
     
     def __init__(self, model_name: str = "all-MiniLM-L6-v2"):
         self.model_name = model_name
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name=model_name,
-            model_kwargs={'device': 'cpu'},  # Use GPU if available
+        device = select_device() if settings.embedding_device == "auto" else settings.embedding_device
+        # Weights are cached next to the vector store; transformers loads safetensors when present
+        self.model = SentenceTransformer(
+            model_name,
+            device=device,
+            cache_folder=os.path.join(settings.chroma_db_path, "models"),
+            backend="torch",
+            tokenizer_kwargs={"use_fast": True},
+            truncate_dim=settings.embedding_truncate_dim
+        )
+        
+        precision = settings.embedding_precision
+        if precision == "fp16" or (precision == "auto" and device == "cuda"):
+            self.model.half()
+            precision = "fp16"
+        else:
+            precision = "fp32"
+        
+        # Larger batches keep every core busy on CPU; GPUs take big batches anyway
+        self.batch_size = (os.cpu_count() or 1) * 4 if device == "cpu" else 256
+        # Repeated queries skip the transformer forward pass
+        self._embed_query = lru_cache(maxsize=1024)(
+            lambda text: tuple(self._encode([text])[0].tolist())
+        )
+        logger.info(f"Initialized local embeddings: {model_name} ({device}, {precision})")
+    
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        """One batched forward pass; normalized so cosine == dot product"""
+        return self.model.encode(
+            texts,
+            batch_size=self.batch_size,
+            show_progress_bar=False,
+            normalize_embeddings=True,
+            convert_to_numpy=True
         )
-        logger.info(f"Initialized local embeddings: {model_name} (CPU)")
     
     async def embed_text(self, text: str) -> List[float]:
-        return self.embeddings.embed_query(text)
+        return list(self._embed_query(text))
     
-    async def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        return self.embeddings.embed_documents(texts)
+    async def embed_documents(self, texts: List[str]) -> np.ndarray:
+        return self._encode(texts)
+
+
+@lru_cache(maxsize=1)
+def get_embedder(model_name: str = settings.embedding_model) -> EmbeddingService:
+    """Process-wide EmbeddingService - the model is loaded once and shared"""
+    return EmbeddingService(model_name)
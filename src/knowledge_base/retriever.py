@@ -1,66 +1,134 @@
-from typing import List, Dict, Any
+from typing import Iterable, Iterator, List, Dict, Any, Mapping, Tuple
+from itertools import islice
+import hashlib
 from langchain_core.documents import Document
-from src.knowledge_base.embedder import EmbeddingService
+from src.knowledge_base.embedder import get_embedder
 from src.knowledge_base.chroma_store import ChromaVectorStore
+from src.scraper.content_parser import WebsiteStructureAnalyzer
 from src.logger import logger
 
+# Pages chunked, embedded and stored together - memory stays flat however long the crawl
+BUILD_BATCH_PAGES = 64
+
+
+def _chunk_page(url: str, page_data: dict) -> List[Tuple[str, Dict[str, Any]]]:
+    """Chunk and describe one page"""
+    # Extract content
+    title = page_data.get("title", "")
+    forms = page_data.get("forms", [])
+    
+    # Visible text extracted by the scraper's parse; "html" is only a short preview,
+    # stripped here just for records that predate the "text" field
+    text = page_data.get("text")
+    if text is None:
+        text = WebsiteStructureAnalyzer.extract_text(page_data.get("html", ""))
+    # Form structure is kept as a header
+    form_summary = KnowledgeBaseBuilder._summarize_forms(forms)
+    if form_summary:
+        text = f"{form_summary}\n{text}"
+    
+    page_chunks = []
+    for chunk_idx, chunk in enumerate(KnowledgeBaseBuilder._chunk_text(text, chunk_size=1500)):
+        # Fixed 32-char key over position and content - unchanged chunks keep their id
+        chunk_hash = hashlib.blake2b(chunk.encode(), digest_size=8).hexdigest()
+        doc_id = hashlib.blake2b(f"{url}:{chunk_idx}:{chunk_hash}".encode(), digest_size=16).hexdigest()
+        
+        # Create metadata
+        metadata = {
+            "id": doc_id,
+            "source_url": url,
+            "page_title": title,
+            "chunk_index": chunk_idx,
+            "chunk_hash": chunk_hash,
+            "has_forms": len(forms) > 0,
+            "form_count": len(forms)
+        }
+        page_chunks.append((chunk, metadata))
+    
+    return page_chunks
+
+
 class KnowledgeBaseBuilder:
     """Build and manage knowledge base from scraped content"""
     
     def __init__(self):
-        self.embedder = EmbeddingService()
+        self.embedder = get_embedder()
         self.vector_store = ChromaVectorStore()
     
-    def _chunk_text(self, text: str, chunk_size: int = 1000, overlap: int = 100) -> List[str]:
-        """Split text into overlapping chunks"""
-        chunks = []
-        for i in range(0, len(text), chunk_size - overlap):
-            chunks.append(text[i:i + chunk_size])
-        return chunks
+    @staticmethod
+    def _chunk_text(text: str, chunk_size: int = 1000, overlap: int = 100) -> Iterator[str]:
+        """Lazily yield overlapping chunks of text"""
+        assert 0 <= overlap < chunk_size, "overlap must be smaller than chunk_size"
+        stride = chunk_size - overlap
+        for i in range(0, len(text), stride):
+            yield text[i:i + chunk_size]
+    
+    @staticmethod
+    def _summarize_forms(forms: List[dict]) -> str:
+        """Compact form/field listing so selectors survive HTML stripping"""
+        lines = []
+        for form in forms:
+            fields = ", ".join(
+                f"{field.get('type', 'text')}[name={field.get('name')}]"
+                for field in form.get("fields", [])
+            )
+            lines.append(f"FORM #{form.get('id')} {form.get('method', '')} {form.get('action', '')}: {fields}")
+        return "\n".join(lines)
     
-    async def build_from_scraped_pages(self, scraped_pages: Dict[str, dict]) -> None:
-        """Build knowledge base from scraped pages"""
-        documents = []
-        embeddings = []
+    async def build_from_scraped_pages(self, scraped_pages: Iterable[Tuple[str, dict]]) -> None:
+        """Build knowledge base from (url, page_data) pairs, consumed lazily in batches"""
+        if isinstance(scraped_pages, Mapping):
+            scraped_pages = scraped_pages.items()
+        pages = iter(scraped_pages)
         
-        logger.info(f"Building knowledge base from {len(scraped_pages)} pages")
+        n_pages = n_added = n_unchanged = n_stale = 0
+        while True:
+            batch = list(islice(pages, BUILD_BATCH_PAGES))
+            if not batch:
+                break
+            n_pages += len(batch)
+            added, unchanged, stale = await self._build_batch(batch)
+            n_added += added
+            n_unchanged += unchanged
+            n_stale += stale
         
-        for url, page_data in scraped_pages.items():
-            if page_data.get("status") != "success":
-                continue
-            
-            # Extract content
-            title = page_data.get("title", "")
-            html = page_data.get("html", "")
-            forms = page_data.get("forms", [])
-            
-            # Create chunks
-            chunks = self._chunk_text(html, chunk_size=1500)
-            
-            for chunk_idx, chunk in enumerate(chunks):
-                doc_id = f"{url.replace('/', '_')}_{chunk_idx}"
-                
-                # Create metadata
-                metadata = {
-                    "id": doc_id,
-                    "source_url": url,
-                    "page_title": title,
-                    "chunk_index": chunk_idx,
-                    "has_forms": len(forms) > 0,
-                    "form_count": len(forms)
-                }
-                
-                document = Document(page_content=chunk, metadata=metadata)
-                documents.append(document)
+        logger.info(
+            f"Knowledge base built from {n_pages} pages: {n_added} new chunks, "
+            f"{n_unchanged} unchanged, {n_stale} stale removed"
+        )
+    
+    async def _build_batch(self, batch: List[Tuple[str, dict]]) -> Tuple[int, int, int]:
+        """Chunk, embed and store one batch of pages; returns (added, unchanged, stale) chunk counts"""
+        pages = [(url, page_data) for url, page_data in batch if page_data.get("status") == "success"]
+        
+        # Text is pre-extracted by the scraper - slicing it is cheaper than shipping pages to workers
+        chunked = [_chunk_page(url, page_data) for url, page_data in pages]
+        
+        documents = [
+            Document(page_content=chunk, metadata=metadata)
+            for page_chunks in chunked
+            for chunk, metadata in page_chunks
+        ]
         
-        # Embed all documents
-        logger.info(f"Embedding {len(documents)} document chunks...")
+        # Drop chunks of re-scraped pages whose content changed - their ids no longer exist
+        stale = 0
+        for (url, _), page_chunks in zip(pages, chunked):
+            stale += await self.vector_store.delete_stale(url, {metadata["id"] for _, metadata in page_chunks})
+        
+        # Skip chunks already stored by a previous run - embedding is the dominant cost
+        existing = await self.vector_store.existing_ids([doc.metadata["id"] for doc in documents])
+        documents = [doc for doc in documents if doc.metadata["id"] not in existing]
+        if not documents:
+            return 0, len(existing), stale
+        
+        # Embed the batch's new documents
+        logger.info(f"Embedding {len(documents)} new document chunks ({len(existing)} unchanged)...")
         texts = [doc.page_content for doc in documents]
         embeddings = await self.embedder.embed_documents(texts)
         
         # Add to vector store
         await self.vector_store.add_documents(documents, embeddings)
-        logger.info("Knowledge base built successfully")
+        return len(documents), len(existing), stale
     
     async def search(self, query: str, n_results: int = 5) -> List[Dict[str, Any]]:
         """Search knowledge base"""
@@ -71,3 +139,18 @@ class KnowledgeBaseBuilder:
         except Exception as e:
             logger.error(f"Error searching knowledge base: {str(e)}")
             raise
+    
+    async def search_many(self, queries: List[str], n_results: int = 5) -> List[Dict[str, Any]]:
+        """Search several sub-queries with one batched encode and one ANN query"""
+        try:
+            query_embeddings = await self.embedder.embed_documents(queries)
+            per_query = await self.vector_store.search_many(query_embeddings, n_results)
+            
+            # Merge best-first, keeping each chunk once
+            merged = {}
+            for result in sorted((r for results in per_query for r in results), key=lambda r: r["distance"]):
+                merged.setdefault(result["id"], result)
+            return list(merged.values())
+        except Exception as e:
+            logger.error(f"Error searching knowledge base: {str(e)}")
+            raise
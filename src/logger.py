@@ -8,9 +8,10 @@ def setup_logger():
     # Remove default handler
     logger.remove()
     
-    # Add console handler
+    # Add console handler - no ANSI codes when output is piped or redirected
     logger.add(
-        sys.stdout,
+        sys.stderr,
+        colorize=sys.stderr.isatty(),
         format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{function}</cyan> - <level>{message}</level>",
         level=settings.langgraph_log_level
     )
@@ -21,7 +22,8 @@ def setup_logger():
         format="{time:YYYY-MM-DD HH:mm:ss} | {level: <8} | {name}:{function} - {message}",
         level="DEBUG",
         rotation="500 MB",
-        retention="7 days"
+        retention="7 days",
+        enqueue=True  # Writes happen on a background thread
     )
     
     return logger
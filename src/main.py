@@ -35,7 +35,7 @@ async def main():
     # Step 2: Build knowledge base
     logger.info("Step 2: Building knowledge base...")
     kb_builder = KnowledgeBaseBuilder()
-    await kb_builder.build_from_scraped_pages(scraped_pages)
+    await kb_builder.build_from_scraped_pages(scraper.iter_pages())  # Streamed from NDJSON
     logger.info("Knowledge base built")
     
     # Test RAG retrieval
@@ -43,25 +43,19 @@ async def main():
     results = await kb_builder.search("login form")
     logger.info(f"RAG Results: {type(results)} len={len(results) if results else 0}")
     
-    # Clean results display
-    flat_results = results[0] if results and isinstance(results[0], list) else results or []
-    for i, r in enumerate(flat_results[:3]):
-        try:
-            meta = r.get('metadata', {})
-            if isinstance(meta, list): 
-                meta = meta[0] if meta else {}
-            url = meta.get('source_url', f'chunk-{i}')[:60]
-            dist = r.get('distance', 0.0)
-            logger.info(f"  - {url}... (dist: {dist:.3f})")
-        except:
-            logger.info(f"  - Raw result {i}: {type(r)}")
+    for i, r in enumerate(results[:3]):
+        url = r["metadata"].get("source_url", f"chunk-{i}")[:60]
+        logger.info(f"  - {url}... (dist: {r['distance']:.3f})")
     
     # Step 3: Agent execution with RAG context
     logger.info("Step 3: Launching agent...")
     agent = WebAutomationAgent(kb_builder)
     
     # Execute with context injection
-    result = await agent.execute_task_with_context(task, domain, kb_builder)
+    try:
+        result = await agent.execute_task_with_context(task, domain, kb_builder)
+    finally:
+        await agent.aclose()
     
     # Results
     logger.info(f"Status: {'SUCCESS' if result.get('success') else 'FAILED'}")
@@ -1,17 +1,23 @@
-import asyncio
 from typing import Dict, Any
+import asyncio
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
 from src.browser.playwright_adapter import PlaywrightAdapter
 
+# How soon a navigating submit issues its main-frame request; none by then means AJAX
+NAVIGATION_START_GRACE_S = 0.5
+# How long submit_form waits for a started navigation to reach domcontentloaded
+SUBMIT_NAVIGATION_TIMEOUT_MS = 2_500
+
 class BrowserTools:
     """Collection of browser automation tools"""
     
     def __init__(self, browser_adapter: PlaywrightAdapter):
         self.browser = browser_adapter
     
-    async def navigate(self, url: str) -> Dict[str, Any]:
+    async def navigate(self, url: str, wait_until: str = "domcontentloaded") -> Dict[str, Any]:
         """Navigate to URL"""
         try:
-            await self.browser.navigate(url)
+            await self.browser.navigate(url, wait_until=wait_until)
             state = await self.browser.get_page_state()
             return {"success": True, "message": f"Navigated to {url}", "page_state": state}
         except Exception as e:
@@ -30,8 +36,8 @@ class BrowserTools:
         """Click element"""
         try:
             await self.browser.click(selector)
-            await asyncio.sleep(0.5)  # Brief wait for potential changes
-            state = await self.browser.get_page_state()
+            # Clicks and submits are validated against page content, so fetch the preview
+            state = await self.browser.get_page_state(include_html=True)
             return {"success": True, "message": f"Clicked {selector}", "page_state": state}
         except Exception as e:
             return {"success": False, "error": str(e)}
@@ -48,13 +54,48 @@ class BrowserTools:
     async def submit_form(self, form_selector: str) -> Dict[str, Any]:
         """Submit form"""
         try:
-            await self.browser.submit_form(form_selector)
-            await asyncio.sleep(2)  # Wait for form submission
-            state = await self.browser.get_page_state()
+            page = self.browser.page
+            started = asyncio.Event()
+            committed = asyncio.Event()
+            
+            def on_request(request) -> None:
+                if request.is_navigation_request() and request.frame == page.main_frame:
+                    started.set()
+            
+            def on_navigated(frame) -> None:
+                if frame == page.main_frame:
+                    started.set()
+                    committed.set()
+            
+            # Listen before submitting so a fast navigation can't be missed
+            page.on("request", on_request)
+            page.on("framenavigated", on_navigated)
+            try:
+                # Failures of the submit itself propagate - only the navigation wait is lenient
+                await self.browser.submit_form(form_selector)
+                await self._wait_for_submit_navigation(page, started, committed)
+            finally:
+                page.remove_listener("request", on_request)
+                page.remove_listener("framenavigated", on_navigated)
+            state = await self.browser.get_page_state(include_html=True)
             return {"success": True, "message": "Form submitted", "page_state": state}
         except Exception as e:
             return {"success": False, "error": str(e)}
     
+    @staticmethod
+    async def _wait_for_submit_navigation(page, started: asyncio.Event, committed: asyncio.Event) -> None:
+        """Wait for a navigation the submit started; AJAX submits return after the start grace period"""
+        try:
+            await asyncio.wait_for(started.wait(), NAVIGATION_START_GRACE_S)
+        except asyncio.TimeoutError:
+            return  # AJAX submit - the page updated in place without navigating
+        
+        try:
+            await asyncio.wait_for(committed.wait(), SUBMIT_NAVIGATION_TIMEOUT_MS / 1000)
+            await page.wait_for_load_state("domcontentloaded", timeout=SUBMIT_NAVIGATION_TIMEOUT_MS)
+        except (asyncio.TimeoutError, PlaywrightTimeoutError):
+            pass  # Slow response - report the page as it is now
+    
     async def extract_text(self, selector: str) -> Dict[str, Any]:
         """Extract text from element"""
         try:
@@ -63,10 +104,10 @@ class BrowserTools:
         except Exception as e:
             return {"success": False, "error": str(e)}
     
-    async def get_page_state(self) -> Dict[str, Any]:
+    async def get_page_state(self, include_html: bool = False) -> Dict[str, Any]:
         """Get current page state"""
         try:
-            state = await self.browser.get_page_state()
+            state = await self.browser.get_page_state(include_html=include_html)
             return {"success": True, "page_state": state}
         except Exception as e:
             return {"success": False, "error": str(e)}
@@ -1,5 +1,20 @@
 from bs4 import BeautifulSoup
 from typing import Dict, List, Any
+import soupsieve as sv
+
+# C-backed tree builder, several times faster than the pure-Python html.parser
+PARSER = "lxml"
+
+# Selectors compiled once instead of per call / per-tag Python predicates
+FORMS = sv.compile("form")
+FORM_FIELDS = sv.compile("input, textarea, select")
+SUBMIT_BUTTON = sv.compile("button[type=submit]")
+SUBMIT_INPUT = sv.compile("input[type=submit]")
+NAV = sv.compile("nav")
+NAV_LIST = sv.compile("ul[class*=nav]")
+LINKS = sv.compile("a")
+HEADINGS = sv.compile("h1, h2, h3")
+BUTTONS = sv.compile("button")
 
 class WebsiteStructureAnalyzer:
     """Parse and extract structured information from HTML"""
@@ -7,10 +22,14 @@ class WebsiteStructureAnalyzer:
     @staticmethod
     def extract_forms(html: str) -> List[Dict[str, Any]]:
         """Extract form information from HTML"""
-        soup = BeautifulSoup(html, "html.parser")
+        return WebsiteStructureAnalyzer._extract_forms_from_soup(BeautifulSoup(html, PARSER))
+    
+    @staticmethod
+    def _extract_forms_from_soup(soup: BeautifulSoup) -> List[Dict[str, Any]]:
+        """Extract form information from an already parsed document"""
         forms = []
         
-        for form in soup.find_all("form"):
+        for form in FORMS.select(soup):
             form_data = {
                 "id": form.get("id") or form.get("name") or f"form-{len(forms)}",
                 "action": form.get("action", ""),
@@ -18,7 +37,7 @@ class WebsiteStructureAnalyzer:
                 "fields": []
             }
             
-            for field in form.find_all(["input", "textarea", "select"]):
+            for field in FORM_FIELDS.select(form):
                 field_info = {
                     "name": field.get("name"),
                     "type": field.get("type", "text"),
@@ -31,9 +50,7 @@ class WebsiteStructureAnalyzer:
                 form_data["fields"].append(field_info)
             
             # Find submit button
-            submit_btn = form.find("button", {"type": "submit"})
-            if not submit_btn:
-                submit_btn = form.find("input", {"type": "submit"})
+            submit_btn = SUBMIT_BUTTON.select_one(form) or SUBMIT_INPUT.select_one(form)
             
             if submit_btn:
                 form_data["submit_button"] = {
@@ -48,14 +65,18 @@ class WebsiteStructureAnalyzer:
     @staticmethod
     def extract_navigation(html: str) -> List[Dict[str, str]]:
         """Extract navigation links"""
-        soup = BeautifulSoup(html, "html.parser")
+        return WebsiteStructureAnalyzer._extract_navigation_from_soup(BeautifulSoup(html, PARSER))
+    
+    @staticmethod
+    def _extract_navigation_from_soup(soup: BeautifulSoup) -> List[Dict[str, str]]:
+        """Extract navigation links from an already parsed document"""
         nav_items = []
         
         # Look for navigation elements
-        nav = soup.find("nav") or soup.find("ul", class_=lambda x: x and "nav" in x)
+        nav = NAV.select_one(soup) or NAV_LIST.select_one(soup)
         
         if nav:
-            for link in nav.find_all("a"):
+            for link in LINKS.select(nav):
                 nav_items.append({
                     "text": link.get_text(strip=True),
                     "href": link.get("href", ""),
@@ -64,31 +85,46 @@ class WebsiteStructureAnalyzer:
         
         return nav_items
     
+    @staticmethod
+    def extract_text(html: str) -> str:
+        """Extract visible text content, dropping scripts and styles"""
+        soup = BeautifulSoup(html, PARSER)
+        
+        for script in soup(["script", "style"]):
+            script.decompose()
+        
+        return soup.get_text(separator=" ", strip=True)
+    
     @staticmethod
     def parse_page(html: str, url: str) -> Dict[str, Any]:
         """Parse complete page structure"""
-        soup = BeautifulSoup(html, "html.parser")
+        soup = BeautifulSoup(html, PARSER)
+        
+        # Forms and navigation read from the same parse, before scripts are stripped
+        forms = WebsiteStructureAnalyzer._extract_forms_from_soup(soup)
+        navigation = WebsiteStructureAnalyzer._extract_navigation_from_soup(soup)
         
         # Extract text content
         for script in soup(["script", "style"]):
             script.decompose()
         
         text_content = soup.get_text(separator=" ", strip=True)
+        meta_description = soup.find("meta", attrs={"name": "description"})
         
         return {
             "url": url,
             "title": soup.title.string if soup.title else "",
-            "meta_description": soup.find("meta", attrs={"name": "description"})["content"] if soup.find("meta", attrs={"name": "description"}) else "",
-            "forms": WebsiteStructureAnalyzer.extract_forms(html),
-            "navigation": WebsiteStructureAnalyzer.extract_navigation(html),
+            "meta_description": meta_description.get("content", "") if meta_description else "",
+            "forms": forms,
+            "navigation": navigation,
             "text_content": text_content[:2000],  # First 2000 chars
-            "headings": [h.get_text(strip=True) for h in soup.find_all(["h1", "h2", "h3"])],
+            "headings": [h.get_text(strip=True) for h in HEADINGS.select(soup)],
             "buttons": [
                 {
                     "text": btn.get_text(strip=True),
                     "id": btn.get("id"),
                     "class": btn.get("class")
                 }
-                for btn in soup.find_all("button")
+                for btn in BUTTONS.select(soup)
             ]
         }
@@ -1,22 +1,244 @@
 import asyncio
-from typing import Dict, Set
-from urllib.parse import urljoin, urlparse
-from bs4 import BeautifulSoup
+import json
+import re
+import sys
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urljoin, urlparse, urlsplit, urlunsplit
+import aiohttp
+from lxml import etree
+from pybloom_live import ScalableBloomFilter
+from src.config import settings
 from src.logger import logger
 
+try:
+    import orjson
+except ImportError:  # stdlib fallback
+    orjson = None
+
+
+# Client-rendered shells: an empty mount point, a framework bundle, or a JS-required notice
+SPA_MARKERS = re.compile(
+    r'<div id="(?:root|app|__next)"[^>]*>\s*</div>'
+    r'|<script[^>]+src="[^"]*(?:react|vue|angular)[^"]*"'
+    r'|enable javascript to run this app'
+    r'|<noscript>[^<]*(?:enable|requires?) javascript',
+    re.IGNORECASE
+)
+# Static responses shorter than this are treated as JS bootstraps/redirect stubs
+MIN_STATIC_HTML = 512
+
+# Pages fetched at once per crawl
+CONCURRENCY = 5
+# New links followed from each scraped page
+MAX_NEXT_LEVEL = 10
+# Default page budget per depth level below the root
+PAGES_PER_LEVEL = 5
+# Links to these files are never queued - one compiled scan instead of per-suffix checks
+_SKIP_EXT_RE = re.compile(
+    r"\.(?:pdf|zip|jpe?g|png|gif|svg|ico|css|js|woff2?|mp[34]|webm|mov)(?:\?|$)",
+    re.IGNORECASE
+)
+# Ports implied by the scheme, stripped during canonicalization
+DEFAULT_PORTS = frozenset({("http", 80), ("https", 443)})
+# Subresources aborted in the scraper's browser context
+BLOCKED_RESOURCE_TYPES = frozenset({"image", "media", "font", "stylesheet"})
+# Named input/textarea/select under a form, selected in one compiled C-level pass
+NAMED_FIELDS = etree.XPath(".//*[self::input or self::textarea or self::select][@name != '']")
+# Characters of raw HTML kept per page
+HTML_PREVIEW_CHARS = 2048
+# Characters of HTML fed to the pull parser at a time
+PARSE_SLICE_CHARS = 65536
+# Handled elements between deletions of the already-read part of the tree
+DROP_EVERY = 256
+# Characters of visible text kept per page - what the knowledge base chunks
+PAGE_TEXT_CHARS = 32768
+# Elements whose text is never rendered
+INVISIBLE_TAGS = frozenset({"script", "style"})
+# Rendered pages served by one browser context before it is recreated
+CONTEXT_ROTATE_EVERY = 50
+
+
+
+async def _block_heavy_resources(route) -> None:
+    """Route handler: abort subresources a text scrape never reads"""
+    if route.request.resource_type in BLOCKED_RESOURCE_TYPES:
+        await route.abort()
+    else:
+        await route.continue_()
+
+
+def _dumps_line(obj: dict) -> bytes:
+    """One NDJSON record"""
+    if orjson is not None:
+        return orjson.dumps(obj) + b"\n"
+    return json.dumps(obj).encode("utf-8") + b"\n"
+
+
+def _loads_line(line: bytes) -> dict:
+    if orjson is not None:
+        return orjson.loads(line)
+    return json.loads(line)
+
+
+def _skipped_page(url: str, content_type: str) -> dict:
+    """Record for a response that is not a page - PDFs, images, JSON..."""
+    logger.debug(f"Skipping non-HTML {url} ({content_type})")
+    return {"url": url, "status": "skipped", "content_type": content_type, "forms": [], "links": []}
+
+
+def canonicalize_url(url: str) -> str:
+    """Normalize URL variants to one interned string.
+    
+    Lowercases scheme and host, drops default ports and the fragment, and
+    sorts query params; interning shares one copy across visited/queues/keys.
+    Raises ValueError for malformed authorities such as a non-numeric port.
+    """
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    if (scheme, parts.port) in DEFAULT_PORTS:
+        netloc = netloc.rsplit(":", 1)[0]
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return sys.intern(urlunsplit((scheme, netloc, parts.path or "/", query, "")))
+
+
+def _collect_text(elem: etree._Element, parts: List[str]) -> None:
+    """Append the visible text of elem's subtree, and its tail, in document order"""
+    # Comments and processing instructions have non-str tags; only their tails are page text
+    if isinstance(elem.tag, str) and elem.tag not in INVISIBLE_TAGS:
+        etree.strip_elements(elem, *INVISIBLE_TAGS, with_tail=False)
+        for text in elem.itertext():
+            text = text.strip()
+            if text:
+                parts.append(text)
+    if elem.tail:
+        tail = elem.tail.strip()
+        if tail:
+            parts.append(tail)
+
+
+def _iter_parsed(html: str, text_parts: List[str]) -> Iterator[etree._Element]:
+    """Yield closed title/form/a elements while feeding the page in slices.
+    
+    Once exhausted, the text of whatever is left of the tree is appended to text_parts.
+    """
+    parser = etree.HTMLPullParser(events=("end",), tag=("title", "form", "a"))
+    # str slices go straight to the parser - no encoded copy of the whole page
+    for start in range(0, len(html), PARSE_SLICE_CHARS):
+        parser.feed(html[start:start + PARSE_SLICE_CHARS])
+        for _, elem in parser.read_events():
+            yield elem
+    root = parser.close()
+    for _, elem in parser.read_events():
+        yield elem
+    if root is not None:
+        _collect_text(root, text_parts)
+
+
+def _drop_preceding(elem: etree._Element, text_parts: List[str]) -> None:
+    """Delete everything that precedes elem in the document, keeping its visible text"""
+    path = [elem]
+    path.extend(elem.iterancestors())
+    # Root first, so text is taken in document order
+    for i in range(len(path) - 1, 0, -1):
+        parent, child = path[i], path[i - 1]
+        if parent.text and parent.tag not in INVISIBLE_TAGS:
+            text = parent.text.strip()
+            if text:
+                text_parts.append(text)
+        parent.text = None
+        end = parent.index(child)
+        for sibling in parent[:end]:
+            _collect_text(sibling, text_parts)
+        del parent[:end]
+
+
+def _extract_page(html: str) -> Tuple[str, List[dict], List[str], str]:
+    """Stream title, forms, raw link hrefs and visible text out of a page in one pass.
+    
+    The pull parser only surfaces the tags we read. Every DROP_EVERY handled
+    elements, the text of everything before the current one is taken and the
+    elements deleted, so the live tree stays a bounded window of the page
+    rather than the whole DOM.
+    """
+    title = ""
+    forms = []
+    hrefs = []
+    text_parts = []
+    
+    # Bound once - the loop below runs for every link and field on the page
+    add_href = hrefs.append
+    add_form = forms.append
+    handled = 0
+    try:
+        for elem in _iter_parsed(html, text_parts):
+            tag = elem.tag
+            if tag == "a":
+                href = elem.get("href")
+                if href is not None:
+                    add_href(href)
+            elif tag == "form":
+                # SAFE forms - NO JS EVALUATE
+                fields = []
+                add_field = fields.append
+                for field in NAMED_FIELDS(elem):
+                    attrib = field.attrib
+                    add_field({
+                        "name": attrib["name"],
+                        "type": attrib.get("type", "text"),
+                        "required": "required" in attrib
+                    })
+                if fields:
+                    attrib = elem.attrib
+                    add_form({
+                        "id": attrib.get("id") or "form-unknown",
+                        "action": attrib.get("action", ""),
+                        "method": attrib.get("method", "GET"),
+                        "fields": fields
+                    })
+            elif not title:
+                title = (elem.text or "").strip()
+            
+            handled += 1
+            # Amortized; deferred while inside a form, whose fields are read at its end
+            if handled >= DROP_EVERY and next(elem.iterancestors("form"), None) is None:
+                _drop_preceding(elem, text_parts)
+                handled = 0
+    except etree.XMLSyntaxError as e:
+        logger.debug(f"Stopped parsing early: {e}")
+    
+    return title, forms, hrefs, " ".join(text_parts)
+
 
 class WebScraperModule:
     """Async web scraper using Playwright for dynamic content"""
     
-    def __init__(self, domain: str, depth: int = 3, timeout: int = 30000):
+    def __init__(self, domain: str, depth: int = 3, timeout: int = 30000, max_pages: Optional[int] = None):
         self.domain = domain
+        self._domain_netloc = urlparse(canonicalize_url(domain)).netloc
         self.depth = depth
+        # Total pages the crawl may queue, root included; defaults to the 5-per-level bound
+        self.max_pages = max_pages if max_pages is not None else 1 + PAGES_PER_LEVEL * max(depth - 1, 0)
+        self._n_enqueued = 0
         self.timeout = timeout
-        self.visited: Set[str] = set()
+        # Approximate membership: a rare false positive only skips a page, memory stays flat
+        self.visited = ScalableBloomFilter(initial_capacity=10000, error_rate=1e-4)
+        # Canonical URLs ever queued for a BFS level, shared across levels
+        self.enqueued = ScalableBloomFilter(initial_capacity=10000, error_rate=1e-4)
+        # url -> small summary; full page records are streamed to settings.scraper_output_path
         self.scraped_pages: Dict[str, dict] = {}
+        self._out = None
         self.playwright = None
         self.browser = None
         self.context = None
+        # Pre-opened pages reused across URLs instead of one new page per URL
+        self._page_pool: asyncio.Queue = asyncio.Queue()
+        self._pages_since_rotation = 0
+        self._rotate_lock = asyncio.Lock()
+        self.http_session: Optional[aiohttp.ClientSession] = None
+        # netloc -> False once a page there needed the browser; skip static fetches after that
+        self.static_domains: Dict[str, bool] = {}
+        self._sem = asyncio.Semaphore(CONCURRENCY)
     
     async def initialize(self):
         """Initialize Playwright browser"""
@@ -24,12 +246,85 @@ class WebScraperModule:
         
         self.playwright = await async_playwright().start()
         self.browser = await self.playwright.chromium.launch(headless=True)
-        self.context = await self.browser.new_context()
+        await self._open_context()
+        # Truncated per crawl so iter_pages() only replays this run
+        self._out = open(settings.scraper_output_path, "wb")
+        if settings.scraper_static_fetch:
+            # Pooled keep-alive connections, no more per host than pages in flight
+            self.http_session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit_per_host=CONCURRENCY),
+                timeout=aiohttp.ClientTimeout(total=self.timeout / 1000)
+            )
         logger.info(f"Browser initialized for domain: {self.domain}")
     
+    async def _open_context(self, storage_state: Optional[dict] = None) -> None:
+        """Create the browser context and fill the page pool from it - all or nothing"""
+        context = await self.browser.new_context(storage_state=storage_state)
+        try:
+            # One context-wide route with a module-level handler - no per-page closures to leak
+            await context.route("**/*", _block_heavy_resources)
+            pages = [await context.new_page() for _ in range(CONCURRENCY)]
+        except Exception:
+            try:
+                await context.close()
+            except Exception:
+                pass
+            raise
+        
+        self.context = context
+        for page in pages:
+            self._page_pool.put_nowait(page)
+        self._pages_since_rotation = 0
+    
+    async def _maybe_rotate_context(self) -> None:
+        """Recreate the context every CONTEXT_ROTATE_EVERY pages to bound Playwright's memory growth.
+        
+        The page pool is always refilled: with the old pages if the old context
+        can't be saved, with a fresh context if it can't be reopened with its
+        state, and with None markers (rendered fetches fail fast) if no context
+        can be opened at all.
+        """
+        if self._pages_since_rotation < CONTEXT_ROTATE_EVERY:
+            return
+        
+        async with self._rotate_lock:
+            if self._pages_since_rotation < CONTEXT_ROTATE_EVERY:
+                return  # Another worker rotated while we waited
+            
+            logger.debug(f"Rotating browser context after {self._pages_since_rotation} pages")
+            # Take every pooled page back - waits for in-flight renders to finish
+            pages = [await self._page_pool.get() for _ in range(CONCURRENCY)]
+            try:
+                storage_state = await self.context.storage_state()  # Keep cookies/auth across the swap
+                await self.context.close()
+            except Exception as e:
+                logger.warning(f"Context rotation failed, keeping the current context: {e}")
+                for page in pages:
+                    self._page_pool.put_nowait(page)
+                self._pages_since_rotation = 0  # Retry after another full round, not on every page
+                return
+            
+            try:
+                await self._open_context(storage_state=storage_state)
+            except Exception as e:
+                logger.warning(f"Reopening the context with its state failed, starting fresh: {e}")
+                try:
+                    await self._open_context()
+                except Exception as e:
+                    logger.error(f"Could not open a browser context: {e}")
+                    self.context = None
+                    # Wake workers already waiting on the pool
+                    for _ in range(CONCURRENCY):
+                        self._page_pool.put_nowait(None)
+    
     async def close(self):
         """Close browser and cleanup"""
         try:
+            if self._out:
+                self._out.close()
+                self._out = None
+            if self.http_session:
+                await self.http_session.close()
             if self.context:
                 await self.context.close()
             if self.browser:
@@ -42,18 +337,68 @@ class WebScraperModule:
     
     def _is_same_domain(self, url: str) -> bool:
         """Check if URL belongs to the same domain"""
-        parsed_url = urlparse(url)
-        parsed_domain = urlparse(self.domain)
-        return parsed_url.netloc == parsed_domain.netloc
+        return urlparse(url).netloc == self._domain_netloc
+    
+    async def _fetch_static(self, url: str) -> Optional[dict]:
+        """Fetch plain server-rendered HTML over HTTP.
+        
+        Returns the stored page record, a skipped record for a non-HTML
+        response, or None if this URL has to go through the browser.
+        """
+        netloc = urlparse(url).netloc
+        if not self.http_session or not self.static_domains.get(netloc, True):
+            return None
+        
+        try:
+            async with self.http_session.get(url, allow_redirects=True) as response:
+                if response.status != 200:
+                    # Error pages say nothing about whether the site needs a browser
+                    logger.debug(f"Static fetch got {response.status} for {url}")
+                    return None
+                if "html" not in response.content_type:
+                    # Not a page at all - same, the domain stays static
+                    return _skipped_page(url, response.content_type)
+                html = await response.text()
+                final_url = str(response.url)
+        except Exception as e:
+            # Transient (timeout, reset...) - only this URL falls back
+            logger.debug(f"Static fetch failed for {url}: {e}")
+            return None
+        
+        if len(html) < MIN_STATIC_HTML or SPA_MARKERS.search(html):
+            # A JS shell - the site renders client-side, use the browser from now on
+            logger.debug(f"Falling back to browser for {netloc}")
+            self.static_domains[netloc] = False
+            return None
+        
+        # After redirects, relative links resolve against where the page actually is
+        return self._store_page(url, html, base_url=final_url)
     
     async def scrape_page(self, url: str) -> dict:
         """Bulletproof scraper - handles all edge cases"""
+        try:
+            url = canonicalize_url(url)
+        except ValueError as e:
+            logger.debug(f"Malformed URL {url}: {e}")
+            return {"url": url, "error": str(e), "status": "error"}
         if url in self.visited:
             return self.scraped_pages.get(url, {})
         
         self.visited.add(url)
+        
+        # Bounds how many pages are open in the shared context at once
+        async with self._sem:
+            return await self._fetch_page(url)
+    
+    async def _fetch_page(self, url: str) -> dict:
+        """Fetch one page, statically if possible, else through Playwright"""
         logger.info(f"Scraping: {url}")
         
+        # Stored page or skipped non-HTML record - either way no browser download
+        page_data = await self._fetch_static(url)
+        if page_data is not None:
+            return page_data
+        
         page = None
         try:
             # DOUBLE CHECK context exists
@@ -61,24 +406,33 @@ class WebScraperModule:
                 logger.error(" NO CONTEXT")
                 return {"url": url, "error": "No browser context", "status": "error"}
             
-            page = await self.context.new_page()
-            if not page:
-                logger.error(" NO PAGE CREATED")
-                return {"url": url, "error": "Failed to create page", "status": "error"}
-            
-            logger.debug(f" Page created: {page}")
+            page = await self._page_pool.get()
+            if page is None:
+                # Context could not be reopened - pass the marker on to the next waiter
+                self._page_pool.put_nowait(None)
+                return {"url": url, "error": "No browser context", "status": "error"}
+            self._pages_since_rotation += 1
+            logger.debug(f" Page acquired: {page}")
             
             # Navigate SAFELY
             logger.debug(f"Goto {url}")
-            response = await page.goto(url, timeout=15000)
+            response = await page.goto(url, wait_until="domcontentloaded", timeout=15000)
             if not response:
                 logger.error(" NO RESPONSE")
                 return {"url": url, "error": "No HTTP response", "status": "error"}
             
             logger.debug(f" Response {response.status}")
             
-            # Wait for content
-            await asyncio.sleep(1.5)
+            # PDFs, images, JSON... have no forms or links worth parsing
+            content_type = response.headers.get("content-type", "")
+            if "html" not in content_type:
+                return _skipped_page(url, content_type)
+            
+            # Wait for content - returns as soon as the network settles
+            try:
+                await page.wait_for_load_state("networkidle", timeout=3000)
+            except Exception:
+                logger.debug(f"No network idle for {url}, continuing")
             
             # CHECK PAGE STILL ALIVE
             if page.is_closed():
@@ -95,44 +449,14 @@ class WebScraperModule:
                 logger.error(f" content() failed: {content_err}")
                 return {"url": url, "error": str(content_err), "status": "error"}
             
-            # SAFE title
-            title = "No title"
+            # SAFE title - falls back to the parsed <title>
+            title = None
             try:
                 title = await page.title()
             except:
                 pass
             
-            # SAFE forms - NO JS EVALUATE
-            soup = BeautifulSoup(html, "html.parser")
-            forms = []
-            for form in soup.find_all("form"):
-                form_data = {
-                    "id": form.get("id") or "form-unknown",
-                    "action": form.get("action", ""),
-                    "method": form.get("method", "GET"),
-                    "fields": []
-                }
-                for field in form.find_all(["input", "textarea", "select"]):
-                    if field.get("name"):
-                        form_data["fields"].append({
-                            "name": field.get("name"),
-                            "type": field.get("type", "text"),
-                            "required": field.has_attr("required")
-                        })
-                if form_data["fields"]:
-                    forms.append(form_data)
-            
-            page_data = {
-                "url": url,
-                "title": title,
-                "html": html[:30000],  # Truncate
-                "forms": forms,
-                "status": "success"
-            }
-            
-            self.scraped_pages[url] = page_data
-            logger.info(f" {url} ({len(forms)} forms)")
-            return page_data
+            return self._store_page(url, html, title, base_url=page.url)
             
         except Exception as e:
             logger.error(f" {url}: {str(e)}")
@@ -140,39 +464,115 @@ class WebScraperModule:
         
         finally:
             if page:
-                try:
-                    await page.close()
-                    logger.debug(f"Page closed for {url}")
-                except Exception as close_err:
-                    logger.debug(f"Page close failed {close_err}")
-
+                await self._release_page(page)
+    
+    async def _release_page(self, page) -> None:
+        """Reset a pooled page and hand it back, replacing it if it was closed"""
+        try:
+            if page.is_closed():
+                page = await self.context.new_page()
+            else:
+                # Drops the previous document, its listeners and timers
+                await page.goto("about:blank")
+        except Exception as reset_err:
+            logger.debug(f"Page reset failed {reset_err}")
+        finally:
+            self._page_pool.put_nowait(page)
+    
+    def _store_page(self, url: str, html: str, title: Optional[str] = None, base_url: Optional[str] = None) -> dict:
+        """Extract forms and links and record a successfully fetched page"""
+        parsed_title, forms, hrefs, text = _extract_page(html)
+        
+        page_data = {
+            "url": url,
+            "title": title or parsed_title or "No title",
+            "html": html[:HTML_PREVIEW_CHARS],  # Preview only - forms and links are already extracted
+            "html_len": len(html),
+            "text": text[:PAGE_TEXT_CHARS],  # Visible text from the same parse, for the knowledge base
+            "forms": forms,
+            # Resolved here from the same parse so scrape() never re-parses the page
+            "links": [urljoin(base_url or url, href) for href in hrefs],
+            "status": "success"
+        }
+        
+        self._out.write(_dumps_line(page_data))
+        self.scraped_pages[url] = {"status": "success", "n_forms": len(forms)}
+        logger.info(f" {url} ({len(forms)} forms)")
+        return page_data
+    
+    def iter_pages(self) -> Iterator[Tuple[str, dict]]:
+        """Stream (url, page_data) records written by the last scrape()"""
+        with open(settings.scraper_output_path, "rb") as f:
+            for line in f:
+                page_data = _loads_line(line)
+                yield page_data["url"], page_data
 
     
+    def _new_links(self, links: List[str]) -> List[str]:
+        """In-domain, never-queued page links from one page, capped at MAX_NEXT_LEVEL and the page budget"""
+        budget = min(MAX_NEXT_LEVEL, self.max_pages - self._n_enqueued)
+        if budget <= 0:
+            return []
+        
+        new_links = []
+        for link_url in links:
+            try:
+                link_url = canonicalize_url(link_url)
+            except ValueError:
+                continue  # Malformed href, e.g. a non-numeric port - skip just this link
+            if not self._is_same_domain(link_url):
+                continue
+            if _SKIP_EXT_RE.search(link_url):
+                continue
+            # add() reports prior membership - one probe covers the whole crawl
+            if self.enqueued.add(link_url):
+                continue
+            new_links.append(link_url)
+            if len(new_links) >= budget:
+                break
+        self._n_enqueued += len(new_links)
+        return new_links
+    
+    async def _crawl_worker(self, frontier: asyncio.Queue) -> None:
+        """Scrape frontier URLs and feed their links back until a None sentinel arrives"""
+        while True:
+            item = await frontier.get()
+            if item is None:
+                frontier.task_done()
+                return
+            
+            url, depth = item
+            try:
+                page_data = await self.scrape_page(url)
+                if page_data.get("status") == "success" and depth + 1 < self.depth:
+                    for link_url in self._new_links(page_data["links"]):
+                        frontier.put_nowait((link_url, depth + 1))
+                await self._maybe_rotate_context()
+            except Exception as e:
+                logger.error(f" {url}: {e}")
+            finally:
+                frontier.task_done()
+    
     async def scrape(self) -> Dict[str, dict]:
-        """Scrape domain starting from root URL"""
+        """Scrape domain starting from root URL.
+        
+        Returns url -> {"status", "n_forms"} summaries; use iter_pages() for full records.
+        """
         try:
             await self.initialize()
             
-            to_visit = [self.domain]
-            current_depth = 0
-            
-            while to_visit and current_depth < self.depth:
-                next_level = []
-                
-                for url in to_visit[:5]:  # Limit concurrent
-                    if url not in self.visited:
-                        page_data = await self.scrape_page(url)
-                        
-                        if page_data.get("status") == "success":
-                            # Extract links for next level
-                            soup = BeautifulSoup(page_data["html"], "html.parser")
-                            for link in soup.find_all("a", href=True):
-                                link_url = urljoin(url, link["href"])
-                                if self._is_same_domain(link_url) and link_url not in self.visited:
-                                    next_level.append(link_url)
-                
-                to_visit = list(set(next_level))[:10]  # Limit depth
-                current_depth += 1
+            # Workers pull (url, depth) pairs, so discovery and fetching overlap across depths
+            frontier: asyncio.Queue = asyncio.Queue()
+            root = canonicalize_url(self.domain)
+            self.enqueued.add(root)
+            self._n_enqueued = 1
+            frontier.put_nowait((root, 0))
+            
+            workers = [asyncio.create_task(self._crawl_worker(frontier)) for _ in range(CONCURRENCY)]
+            await frontier.join()
+            for _ in workers:
+                frontier.put_nowait(None)
+            await asyncio.gather(*workers)
             
             logger.info(f"Scraping complete. Total pages: {len(self.scraped_pages)}")
             return self.scraped_pages
@@ -180,7 +580,6 @@ class WebScraperModule:
         finally:
             await self.close()
 
-
 if __name__ == "__main__":
     async def test_scraper():
         scraper = WebScraperModule("https://httpbin.org", timeout=10000)
@@ -18,6 +18,7 @@ async def test_browser():
         print(f"❌ Browser error: {e}")
     finally:
         await browser.close()
+        await PlaywrightAdapter.shutdown()
         logger.info("Browser test complete")
 
 if __name__ == "__main__":
@@ -0,0 +1,61 @@
+from src.agent.nodes.planner import build_planner_prompt, extract_value, generate_heuristic_plan
+from src.agent.state import WebAutomationState
+
+USER_KEYS = ["username", "user", "id"]
+PASS_KEYS = ["password", "pass"]
+
+
+def test_extract_value_after_is():
+    task = "Login with username is bob and password is hunter2"
+    assert extract_value(task, USER_KEYS) == "bob"
+    assert extract_value(task, PASS_KEYS) == "hunter2"
+
+
+def test_extract_value_quoted():
+    task = "Login where username is 'alice' and password is \"s3cret\""
+    assert extract_value(task, USER_KEYS) == "alice"
+    assert extract_value(task, PASS_KEYS) == "s3cret"
+
+
+def test_extract_value_empty_quotes():
+    task = "Username is '' . Password is '' ."
+    assert extract_value(task, USER_KEYS) == ""
+    assert extract_value(task, PASS_KEYS) == ""
+
+
+def test_extract_value_skips_chained_keys():
+    assert extract_value("login with my user id 42", USER_KEYS) == "42"
+
+
+def test_extract_value_missing():
+    assert extract_value("open the dashboard", USER_KEYS) == "unknown_value"
+
+
+def test_heuristic_plan_steps():
+    plan = generate_heuristic_plan("Login with username is bob and password is pw1", "https://example.com")
+    assert [s["action"] for s in plan["steps"]] == ["navigate", "fill", "fill", "click", "screenshot"]
+    assert [s["step"] for s in plan["steps"]] == [1, 2, 3, 4, 5]
+    assert plan["steps"][0]["target"] == "https://example.com"
+    assert plan["steps"][1]["data"]["value"] == "bob"
+    assert plan["steps"][2]["data"]["value"] == "pw1"
+
+
+def test_heuristic_plan_calls_are_independent():
+    first = generate_heuristic_plan("login user is a", "https://a.example")
+    second = generate_heuristic_plan("login user is b", "https://b.example")
+    assert first["steps"][0]["target"] == "https://a.example"
+    assert first["steps"][1]["data"]["value"] == "a"
+    assert second["steps"][1]["data"]["value"] == "b"
+
+
+def _state(context):
+    return WebAutomationState(task="login", domain="https://example.com", retrieved_context=context)
+
+
+def test_planner_prompt_reflects_ranked_context():
+    far = {"content": "x" * 2500, "distance": 0.9}
+    prompt = build_planner_prompt(_state([far, {"content": "alpha", "distance": 0.1}]))
+    assert prompt.index("alpha") < prompt.index("xxx")
+    # Same first 2000 chars of context repr, but the best chunk differs
+    other = build_planner_prompt(_state([far, {"content": "beta", "distance": 0.1}]))
+    assert prompt != other
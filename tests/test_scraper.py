@@ -0,0 +1,312 @@
+import asyncio
+import io
+import sys
+import aiohttp
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+import src.scraper.web_scraper as web_scraper
+from src.scraper.web_scraper import WebScraperModule, _extract_page, canonicalize_url
+
+LOGIN_PAGE = """<!DOCTYPE html>
+<html><head><title> Sign in </title></head><body>
+<nav><a href="/">Home</a><a href="/docs">Docs</a></nav>
+<form id="login" action="/login" method="post">
+  <a href="/help">Help</a>
+  <input name="username"><input type="password" name="password" required>
+  <input type="submit" value="Log in">
+  <select name="lang"></select>
+</form>
+<a href="/about">About</a>
+</body></html>"""
+
+
+def test_extract_page_title_and_forms():
+    title, forms, _, _ = _extract_page(LOGIN_PAGE)
+    assert title == "Sign in"
+    assert forms == [{
+        "id": "login",
+        "action": "/login",
+        "method": "post",
+        "fields": [
+            {"name": "username", "type": "text", "required": False},
+            {"name": "password", "type": "password", "required": True},
+            {"name": "lang", "type": "text", "required": False},
+        ],
+    }]
+
+
+def test_extract_page_keeps_fields_after_link_in_form():
+    _, forms, hrefs, _ = _extract_page(LOGIN_PAGE)
+    assert "/help" in hrefs
+    assert [f["name"] for f in forms[0]["fields"]] == ["username", "password", "lang"]
+
+
+def test_extract_page_drops_read_elements_without_losing_fields(monkeypatch):
+    monkeypatch.setattr(web_scraper, "DROP_EVERY", 1)
+    title, forms, hrefs, _ = _extract_page(LOGIN_PAGE)
+    assert title == "Sign in"
+    assert hrefs == ["/", "/docs", "/help", "/about"]
+    assert [f["name"] for f in forms[0]["fields"]] == ["username", "password", "lang"]
+
+
+def test_extract_page_skips_forms_without_named_fields():
+    _, forms, _, _ = _extract_page("<html><body><form><input type='submit'></form></body></html>")
+    assert forms == []
+
+
+def test_extract_page_links_in_document_order():
+    _, _, hrefs, _ = _extract_page(LOGIN_PAGE)
+    assert hrefs == ["/", "/docs", "/help", "/about"]
+
+
+def test_extract_page_nested_links():
+    html = "<html><body><div><p><span><a href='/deep'>x</a></span></p><a href='/next'>y</a></div><a>no href</a></body></html>"
+    _, _, hrefs, _ = _extract_page(html)
+    assert hrefs == ["/deep", "/next"]
+
+
+def test_extract_page_xml_declared():
+    html = ('<?xml version="1.0" encoding="ISO-8859-1"?>\n'
+            '<html xmlns="http://www.w3.org/1999/xhtml"><head><title>Café</title></head>'
+            '<body><a href="/x">x</a><form id="f"><input name="q"></form></body></html>')
+    title, forms, hrefs, _ = _extract_page(html)
+    assert title == "Café"
+    assert hrefs == ["/x"]
+    assert forms[0]["fields"] == [{"name": "q", "type": "text", "required": False}]
+
+
+def test_extract_page_spans_parse_slices():
+    filler = "<p>" + "lorem ipsum " * 10000 + "</p>"
+    html = f"<html><body>{filler}<a href='/a'>a</a>{filler}<form><input name='q'></form>{filler}<a href='/b'>b</a></body></html>"
+    title, forms, hrefs, _ = _extract_page(html)
+    assert hrefs == ["/a", "/b"]
+    assert len(forms) == 1
+
+
+def test_extract_page_empty():
+    assert _extract_page("") == ("", [], [], "")
+
+
+@pytest.mark.parametrize("depth, max_pages", [(1, 1), (2, 6), (3, 11)])
+def test_default_page_budget(depth, max_pages):
+    assert WebScraperModule("http://e.com", depth=depth).max_pages == max_pages
+
+
+def test_new_links_stops_at_page_budget():
+    scraper = WebScraperModule("http://e.com", max_pages=4)
+    scraper._n_enqueued = 1  # The root
+    links = [f"http://e.com/{i}" for i in range(20)]
+    assert scraper._new_links(links) == ["http://e.com/0", "http://e.com/1", "http://e.com/2"]
+    assert scraper._new_links(links) == []
+    assert scraper._n_enqueued == 4
+
+
+TEXT_PAGE = """<html><head><title>Docs</title><style>p { color: red }</style></head>
+<body><div>Intro <p>First <b>bold</b> tail</p><!-- note --> after comment
+<script>var hidden = 1;</script><a href="/x">Link text</a> end</div>
+<form><label>Name</label><input name="n"></form>Footer</body></html>"""
+
+
+@pytest.mark.parametrize("drop_every", [1, 2, 256])
+def test_extract_page_visible_text(monkeypatch, drop_every):
+    monkeypatch.setattr(web_scraper, "DROP_EVERY", drop_every)
+    *_, text = _extract_page(TEXT_PAGE)
+    assert text == "Docs Intro First bold tail after comment Link text end Name Footer"
+
+
+def test_static_fetch_skips_non_html_without_browser():
+    async def pdf(request):
+        return web.Response(body=b"%PDF-1.4", content_type="application/pdf")
+
+    async def run():
+        app = web.Application()
+        app.router.add_get("/file", pdf)
+        async with TestServer(app) as server:
+            url = str(server.make_url("/file"))
+            scraper = WebScraperModule(url)
+            async with aiohttp.ClientSession() as session:
+                scraper.http_session = session
+                # No browser context - reaching Playwright would return an error record
+                page_data = await scraper._fetch_page(url)
+            return scraper, page_data
+
+    scraper, page_data = asyncio.run(run())
+    assert page_data["status"] == "skipped"
+    assert page_data["content_type"] == "application/pdf"
+    assert not scraper.static_domains  # A file says nothing about the site needing a browser
+
+
+@pytest.mark.parametrize("url, expected", [
+    ("HTTP://Example.COM", "http://example.com/"),
+    ("http://example.com:80/a", "http://example.com/a"),
+    ("https://example.com:443/a", "https://example.com/a"),
+    ("https://example.com:8443/a", "https://example.com:8443/a"),
+    ("http://example.com/a?b=2&a=1#top", "http://example.com/a?a=1&b=2"),
+    ("http://example.com/a?x=&y=1", "http://example.com/a?x=&y=1"),
+])
+def test_canonicalize_url(url, expected):
+    assert canonicalize_url(url) == expected
+
+
+def test_canonicalize_url_interns():
+    first = canonicalize_url("http://example.com/" + "path")
+    assert first is sys.intern("http://example.com/path")
+
+
+@pytest.mark.parametrize("url", ["http://e.com:abc/", "http://e.com:99999/", "http://[::1/"])
+def test_canonicalize_url_rejects_malformed(url):
+    with pytest.raises(ValueError):
+        canonicalize_url(url)
+
+
+def test_new_links_skips_malformed():
+    scraper = WebScraperModule("http://e.com")
+    links = ["http://e.com:abc/", "http://e.com/a", "http://other.com/b", "http://e.com/a#frag", "http://e.com/x.pdf"]
+    assert scraper._new_links(links) == ["http://e.com/a"]
+
+
+PAGE_BODY = "<html><head><title>T</title></head><body>" + "<p>content</p>" * 50 + "<a href='child'>c</a></body></html>"
+
+
+def _fetch_static(routes, path):
+    """Run _fetch_static against a local server; returns (scraper, result, server url)"""
+    async def run():
+        app = web.Application()
+        for route_path, handler in routes.items():
+            app.router.add_get(route_path, handler)
+        async with TestServer(app) as server:
+            url = str(server.make_url(path))
+            scraper = WebScraperModule(url)
+            scraper._out = io.BytesIO()
+            async with aiohttp.ClientSession() as session:
+                scraper.http_session = session
+                result = await scraper._fetch_static(url)
+            return scraper, result, str(server.make_url("/"))
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("status", [404, 503])
+def test_static_fetch_error_status_keeps_domain_static(status):
+    async def error(request):
+        return web.Response(status=status, text=PAGE_BODY, content_type="text/html")
+
+    scraper, result, _ = _fetch_static({"/missing": error}, "/missing")
+    assert result is None
+    assert not scraper.static_domains
+
+
+def test_static_fetch_spa_shell_marks_domain():
+    async def shell(request):
+        return web.Response(text='<html><body><div id="root"></div></body></html>', content_type="text/html")
+
+    scraper, result, _ = _fetch_static({"/": shell}, "/")
+    assert result is None
+    assert list(scraper.static_domains.values()) == [False]
+
+
+def test_static_fetch_accepts_xhtml_and_resolves_links_after_redirect():
+    async def old(request):
+        raise web.HTTPFound("/new/page")
+
+    async def page(request):
+        return web.Response(text=PAGE_BODY, content_type="application/xhtml+xml")
+
+    scraper, result, root = _fetch_static({"/old": old, "/new/page": page}, "/old")
+    assert result["status"] == "success"
+    assert result["url"].endswith("/old")
+    assert result["links"] == [root + "new/child"]
+    assert not scraper.static_domains
+
+
+class _FakePage:
+    def is_closed(self):
+        return False
+
+
+class _FakeContext:
+    def __init__(self, state_error=None):
+        self.state_error = state_error
+        self.closed = False
+
+    async def route(self, pattern, handler):
+        pass
+
+    async def new_page(self):
+        return _FakePage()
+
+    async def storage_state(self):
+        await asyncio.sleep(0.01)
+        if self.state_error:
+            raise self.state_error
+        return {}
+
+    async def close(self):
+        self.closed = True
+
+
+class _FakeBrowser:
+    """Hands out the given contexts (or raises the given errors) in order"""
+
+    def __init__(self, *contexts):
+        self.contexts = list(contexts)
+
+    async def new_context(self, storage_state=None):
+        context = self.contexts.pop(0)
+        if isinstance(context, Exception):
+            raise context
+        return context
+
+
+def _rotating_scraper(*contexts):
+    scraper = WebScraperModule("http://e.com")
+    scraper.browser = _FakeBrowser(*contexts)
+    return scraper
+
+
+def test_rotation_keeps_pool_when_storage_state_fails():
+    async def run():
+        first = _FakeContext(state_error=RuntimeError("target closed"))
+        scraper = _rotating_scraper(first)
+        await scraper._open_context()
+        scraper._pages_since_rotation = web_scraper.CONTEXT_ROTATE_EVERY
+        await asyncio.wait_for(scraper._maybe_rotate_context(), 1)
+        return scraper, first
+
+    scraper, first = asyncio.run(run())
+    assert scraper.context is first and not first.closed
+    assert scraper._page_pool.qsize() == web_scraper.CONCURRENCY
+    assert scraper._pages_since_rotation == 0
+
+
+def test_rotation_opens_fresh_context_when_reopen_fails():
+    async def run():
+        fresh = _FakeContext()
+        scraper = _rotating_scraper(_FakeContext(), RuntimeError("bad state"), fresh)
+        await scraper._open_context()
+        scraper._pages_since_rotation = web_scraper.CONTEXT_ROTATE_EVERY
+        await asyncio.wait_for(scraper._maybe_rotate_context(), 1)
+        return scraper, fresh
+
+    scraper, fresh = asyncio.run(run())
+    assert scraper.context is fresh
+    assert scraper._page_pool.qsize() == web_scraper.CONCURRENCY
+
+
+def test_rotation_failure_does_not_hang_waiting_fetches():
+    async def run():
+        scraper = _rotating_scraper(_FakeContext(), RuntimeError("crashed"), RuntimeError("crashed"))
+        await scraper._open_context()
+        scraper._pages_since_rotation = web_scraper.CONTEXT_ROTATE_EVERY
+        rotation = asyncio.create_task(scraper._maybe_rotate_context())
+        while not scraper._page_pool.empty():
+            await asyncio.sleep(0)
+        # Waits on the drained pool while the rotation fails
+        fetch = asyncio.create_task(scraper._fetch_page("http://e.com/a"))
+        await asyncio.wait_for(rotation, 1)
+        return scraper, await asyncio.wait_for(fetch, 1)
+
+    scraper, page_data = asyncio.run(run())
+    assert scraper.context is None
+    assert page_data == {"url": "http://e.com/a", "error": "No browser context", "status": "error"}